@@ -3,8 +3,23 @@ from discord.ext import commands, tasks
 from discord.ui import View, Button, Modal, TextInput, Select
 from discord import SelectOption
 import json
-from datetime import datetime
+from datetime import datetime, timedelta, time as dt_time
+from bisect import bisect_right
 import os
+import io
+import time
+import shutil
+import asyncio
+import aiohttp
+import random
+import functools
+import cProfile
+import pstats
+import tracemalloc
+import sqlite3
+import resource
+from collections import OrderedDict, Counter
+from typing import Optional
 import pytz
 
 # --- DÉFINITION DU BOT ---
@@ -12,26 +27,133 @@ TOKEN = os.environ.get("DISCORD_TOKEN")
 intents = discord.Intents.default()
 intents.message_content = True 
 intents.members = True 
-bot = commands.Bot(command_prefix="!", intents=intents)
+# "full" : cache complet de discord.py ; "relevant" : seuls les membres utiles au bot sont gardés (voir SECTION 10)
+MEMBER_CACHE_MODE = os.environ.get("MEMBER_CACHE_MODE", "full").lower()
+MEMBER_LRU_SIZE = int(os.environ.get("MEMBER_LRU_SIZE") or 500)
+member_cache_options = {"member_cache_flags": discord.MemberCacheFlags.none(), "chunk_guilds_at_startup": False} if MEMBER_CACHE_MODE == "relevant" else {}
+bot = commands.AutoShardedBot(command_prefix="!", intents=intents, **member_cache_options)
 
 # --- CONFIGURATION ---
-REPORT_CHANNEL_ID = 1420794939565936743
-ANNUAIRE_CHANNEL_ID = 1421268834446213251
-ABSENCE_CHANNEL_ID = 1420794939565936744
-RADIO_FREQUENCY = "367.6 Mhz"
-ANNOUNCEMENT_CHANNEL_ID = 1420794935975870574
-PRIVATE_CHANNEL_CATEGORY_ID = 1420794939565936749
-MANAGEMENT_CHANNEL_ID = 1426356300429918289 
-BALANCES_SUMMARY_CHANNEL_ID = 1420794939565936748
-STOCK_LOG_CHANNEL_ID = 1425805691754516541
-FINANCE_LOG_CHANNEL_ID = 1426557263220572200
+# Chaque serveur a sa propre configuration (voir !setup config). La guilde historique (LEGACY_GUILD_ID)
+# reprend les salons et les fichiers de données de l'ancienne installation mono-serveur. Sans LEGACY_GUILD_ID,
+# elle est déduite au démarrage si le bot n'est que sur un serveur ; sinon le bot refuse de démarrer.
+LEGACY_GUILD_ID = int(os.environ.get("LEGACY_GUILD_ID") or 0)
+GUILD_CONFIG_FIELDS = {
+    "report_channel_id": ("signalement", "Salon des signalements"),
+    "annuaire_channel_id": ("annuaire", "Salon de l'annuaire"),
+    "absence_channel_id": ("absence", "Salon des absences"),
+    "announcement_channel_id": ("annonce", "Salon des annonces"),
+    "private_channel_category_id": ("prive", "Catégorie des salons privés"),
+    "management_channel_id": ("gestion", "Salon de gestion des employés"),
+    "balances_summary_channel_id": ("soldes", "Salon des récapitulatifs financiers"),
+    "stock_log_channel_id": ("logs_stock", "Salon des logs de stock"),
+    "finance_log_channel_id": ("logs_finance", "Salon des logs financiers"),
+    "radio_frequency": ("radio", "Fréquence radio"),
+}
+LEGACY_GUILD_CONFIG = {
+    "report_channel_id": 1420794939565936743,
+    "annuaire_channel_id": 1421268834446213251,
+    "absence_channel_id": 1420794939565936744,
+    "announcement_channel_id": 1420794935975870574,
+    "private_channel_category_id": 1420794939565936749,
+    "management_channel_id": 1426356300429918289,
+    "balances_summary_channel_id": 1420794939565936748,
+    "stock_log_channel_id": 1425805691754516541,
+    "finance_log_channel_id": 1426557263220572200,
+    "radio_frequency": "367.6 Mhz",
+}
+INTERACTION_TRACE_PATH = os.environ.get("INTERACTION_TRACE_PATH") # Enregistre chaque interaction : heure, auteur, composant ou commande (rejouable avec loadtest.py --replay)
+ABSENCE_DIGEST_HOUR = 8 # Heure (Paris) de publication du récapitulatif quotidien des absences
+MAX_ABSENCE_DAYS = 365
 
 # --- CHEMINS VERS LES FICHIERS DE DONNÉES ---
-STOCKS_PATH = "/data/stocks.json"
-LOCATIONS_PATH = "/data/locations.json"
-ANNUAIRE_PATH = "/data/annuaire.json"
-FINANCES_PATH = "/data/finances.json"
-RECAP_STATUS_PATH = "/data/recap_status.json"
+# Les données sont partitionnées par serveur : DATA_DIR/guilds/<guild_id>/<fichier>
+DATA_DIR = os.environ.get("DATA_DIR", "/data")
+STOCKS_FILE = "stocks.json"
+LOCATIONS_FILE = "locations.json"
+ANNUAIRE_FILE = "annuaire.json"
+FINANCES_FILE = "finances.json"
+RECAP_STATUS_FILE = "recap_status.json"
+ABSENCES_FILE = "absences.json"
+ABSENCE_DIGEST_FILE = "absence_digest.json" # Séparé de recap_status.json : les deux tâches s'exécutent en même temps
+AUDIT_DB_FILE = "audit.sqlite3"
+STOCK_LEDGER_FILE = "stock_ledger.json"
+STOCK_PANELS_FILE = "stock_panels.json"
+EDIT_QUEUE_FILE = "edit_queue.json" # Commun à tous les serveurs, à la racine de DATA_DIR
+GUILD_CONFIG_FILE = "config.json"
+LEGACY_DATA_FILES = (STOCKS_FILE, LOCATIONS_FILE, ANNUAIRE_FILE, FINANCES_FILE, RECAP_STATUS_FILE) # Fichiers de l'installation mono-serveur, à la racine de DATA_DIR
+LEGACY_MIGRATION_MARKER = ".legacy_migrated"
+
+def legacy_data_pending():
+    """Vrai si des données mono-serveur existent mais n'ont été attribuées à aucun serveur."""
+    if LEGACY_GUILD_ID or not any(os.path.exists(os.path.join(DATA_DIR, name)) for name in LEGACY_DATA_FILES): return False
+    guilds_dir = os.path.join(DATA_DIR, "guilds")
+    return not (os.path.isdir(guilds_dir) and any(os.path.exists(os.path.join(guilds_dir, d, LEGACY_MIGRATION_MARKER)) for d in os.listdir(guilds_dir)))
+LEGACY_DATA_PENDING = legacy_data_pending()
+
+def resolve_legacy_guild():
+    """Attribue les données mono-serveur au seul serveur du bot. Retourne False si c'est impossible."""
+    global LEGACY_GUILD_ID, LEGACY_DATA_PENDING
+    if not LEGACY_DATA_PENDING: return True
+    if len(bot.guilds) != 1:
+        print(f"ERREUR: Des données mono-serveur existent dans {DATA_DIR} mais LEGACY_GUILD_ID n'est pas défini et le bot est sur {len(bot.guilds)} serveurs. Définis LEGACY_GUILD_ID puis redémarre.")
+        return False
+    LEGACY_GUILD_ID, LEGACY_DATA_PENDING = bot.guilds[0].id, False
+    print(f"LEGACY_GUILD_ID non défini : les données mono-serveur sont attribuées à {bot.guilds[0].name} ({LEGACY_GUILD_ID}).")
+    return True
+
+def is_blank_data(value):
+    """Vrai pour des données jamais remplies (valeurs par défaut : zéros, listes vides, "N/A")."""
+    if isinstance(value, dict): return all(is_blank_data(v) for v in value.values())
+    if isinstance(value, list): return not value
+    if isinstance(value, str): return value in ("", "N/A")
+    return not value
+
+def migrate_legacy_data(guild_dir: str):
+    """Copie une seule fois les fichiers mono-serveur dans le dossier de la guilde historique. Un fichier déjà
+    rempli n'est jamais écrasé ; un fichier resté aux valeurs par défaut est remplacé par les vraies données."""
+    for name in LEGACY_DATA_FILES:
+        legacy_path, path = os.path.join(DATA_DIR, name), os.path.join(guild_dir, name)
+        if not os.path.exists(legacy_path): continue
+        if os.path.exists(path):
+            try:
+                with open(path, "r", encoding="utf-8") as f: current = json.load(f)
+            except (json.JSONDecodeError, UnicodeDecodeError): current = None
+            if current is not None and not is_blank_data(current):
+                print(f"ATTENTION: {path} contient déjà des données, {legacy_path} n'a pas été importé."); continue
+        shutil.copyfile(legacy_path, path)
+    with open(os.path.join(guild_dir, LEGACY_MIGRATION_MARKER), "w", encoding="utf-8") as f: f.write(format_paris_time(get_paris_time()))
+
+_prepared_guild_dirs = set()
+def guild_path(guild_id: int, filename: str):
+    if LEGACY_DATA_PENDING: raise RuntimeError("Données mono-serveur non attribuées : définis LEGACY_GUILD_ID.") # Évite d'écrire des fichiers vides qui masqueraient les vraies données
+    guild_dir = os.path.join(DATA_DIR, "guilds", str(guild_id))
+    if guild_dir not in _prepared_guild_dirs:
+        os.makedirs(guild_dir, exist_ok=True)
+        if guild_id == LEGACY_GUILD_ID and not os.path.exists(os.path.join(guild_dir, LEGACY_MIGRATION_MARKER)): migrate_legacy_data(guild_dir)
+        _prepared_guild_dirs.add(guild_dir)
+    return os.path.join(guild_dir, filename)
+
+_guild_configs = {}
+def get_guild_config(guild_id: int):
+    if guild_id not in _guild_configs:
+        config = {key: None for key in GUILD_CONFIG_FIELDS}
+        if guild_id == LEGACY_GUILD_ID: config.update(LEGACY_GUILD_CONFIG)
+        try:
+            with open(guild_path(guild_id, GUILD_CONFIG_FILE), "r", encoding="utf-8") as f: config.update(json.load(f))
+        except (FileNotFoundError, json.JSONDecodeError): pass
+        _guild_configs[guild_id] = config
+    return _guild_configs[guild_id]
+
+def save_guild_config(guild_id: int, config: dict):
+    with open(guild_path(guild_id, GUILD_CONFIG_FILE), "w", encoding="utf-8") as f: json.dump(config, f, indent=4, ensure_ascii=False)
+    _guild_configs[guild_id] = config
+
+def get_config_channel(guild: discord.Guild, key: str):
+    """Salon configuré pour ce serveur ; la recherche passe par la guilde pour ne jamais viser le salon d'un autre serveur."""
+    if not guild: return None
+    channel_id = get_guild_config(guild.id).get(key)
+    return guild.get_channel(channel_id) if channel_id else None
 
 def get_paris_time():
     paris_tz = pytz.timezone("Europe/Paris")
@@ -40,11 +162,106 @@ def get_paris_time():
 def format_paris_time(dt_obj):
     return dt_obj.strftime('%d/%m/%Y %H:%M:%S')
 
+# --- PROFILAGE À LA DEMANDE (voir !profile) ---
+# Les fonctions marquées @profiled (callbacks de boutons, on_submit des Modals, constructeurs d'embeds) et les commandes
+# (sous le nom "!commande") peuvent être exécutées sous cProfile (et tracemalloc) pour leurs N prochains appels.
+# Sans demande en cours, le coût se limite à un test sur un dictionnaire vide.
+PROFILES_DIR = os.path.join(DATA_DIR, "profiles")
+PROFILE_TOP_N = 15
+PROFILE_MAX_RESULTS = 20 # Profils gardés en mémoire ; le dossier garde les fichiers (.prof et .txt) des mêmes derniers profils
+PROFILABLE_HANDLERS = set()
+_profile_requests = {} # nom du handler (ou "all") -> {"remaining": int, "memory": bool}
+_profile_results = [] # Derniers profils terminés, du plus récent au plus ancien
+_active_profile = None # cProfile ne supporte qu'un profileur actif à la fois
+
+def _start_profile(name: str):
+    global _active_profile
+    if _active_profile is not None: return None
+    key = name if name in _profile_requests else ("all" if "all" in _profile_requests else None)
+    if key is None: return None
+    request = _profile_requests[key]
+    request["remaining"] -= 1
+    if request["remaining"] <= 0: del _profile_requests[key]
+    session = {"name": name, "memory": request["memory"], "profiler": cProfile.Profile(), "started_tracemalloc": False, "start": time.perf_counter()}
+    if session["memory"]:
+        if not tracemalloc.is_tracing(): tracemalloc.start(); session["started_tracemalloc"] = True
+        session["snapshot"] = tracemalloc.take_snapshot()
+    _active_profile = session
+    session["profiler"].enable()
+    return session
+
+def _finish_profile(session: dict):
+    global _active_profile
+    session["profiler"].disable()
+    _active_profile = None
+    elapsed = time.perf_counter() - session["start"]
+    memory_lines = []
+    if session["memory"]:
+        diff = tracemalloc.take_snapshot().compare_to(session["snapshot"], "lineno")
+        if session["started_tracemalloc"]: tracemalloc.stop()
+        memory_lines = [f"{stat.size_diff / 1024:+9.1f} Kio {stat.count_diff:+6d} blocs  {stat.traceback[0].filename.rsplit(os.sep, 1)[-1]}:{stat.traceback[0].lineno}" for stat in diff[:PROFILE_TOP_N]]
+    stats = pstats.Stats(session["profiler"], stream=io.StringIO())
+    rows = sorted(stats.stats.items(), key=lambda item: item[1][3], reverse=True)[:PROFILE_TOP_N]
+    table = [f"{'appels':>8} {'propre':>9} {'cumulé':>9}  fonction"]
+    for (filename, line, func), (_, ncalls, tottime, cumtime, _) in rows:
+        table.append(f"{ncalls:>8} {tottime * 1000:>7.1f}ms {cumtime * 1000:>7.1f}ms  {func} ({filename.rsplit(os.sep, 1)[-1]}:{line})")
+    stamp = get_paris_time().strftime("%Y%m%d-%H%M%S")
+    base = os.path.join(PROFILES_DIR, f"{session['name'].replace('.', '_')}-{stamp}-{int(time.time() * 1000) % 1000:03d}")
+    try:
+        os.makedirs(PROFILES_DIR, exist_ok=True)
+        stats.dump_stats(base + ".prof")
+        with open(base + ".txt", "w", encoding="utf-8") as f: f.write("\n".join(table + [""] + memory_lines) + "\n")
+    except OSError as e: print(f"Erreur écriture du profil '{session['name']}': {e}")
+    _profile_results.insert(0, {"name": session["name"], "elapsed": elapsed, "table": table, "memory": memory_lines, "path": base + ".prof", "at": format_paris_time(get_paris_time())})
+    del _profile_results[PROFILE_MAX_RESULTS:]
+    _prune_profile_files()
+
+def _prune_profile_files():
+    try:
+        files = sorted((os.path.join(PROFILES_DIR, name) for name in os.listdir(PROFILES_DIR)), key=os.path.getmtime, reverse=True)
+        for path in files[PROFILE_MAX_RESULTS * 2:]: os.remove(path)
+    except OSError as e: print(f"Erreur nettoyage des profils: {e}")
+
+def profiled(func):
+    """Rend une fonction (synchrone ou coroutine) profilable par !profile. Pour une coroutine, le profil couvre
+    aussi le code des autres tâches exécutées pendant ses await : à lire avec ce biais en tête."""
+    name = func.__qualname__
+    PROFILABLE_HANDLERS.add(name)
+    if asyncio.iscoroutinefunction(func):
+        @functools.wraps(func)
+        async def async_wrapper(*args, **kwargs):
+            if not _profile_requests: return await func(*args, **kwargs)
+            session = _start_profile(name)
+            if session is None: return await func(*args, **kwargs)
+            try: return await func(*args, **kwargs)
+            finally: _finish_profile(session)
+        return async_wrapper
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if not _profile_requests: return func(*args, **kwargs)
+        session = _start_profile(name)
+        if session is None: return func(*args, **kwargs)
+        try: return func(*args, **kwargs)
+        finally: _finish_profile(session)
+    return wrapper
+
+@bot.before_invoke
+async def start_command_profile(ctx):
+    if not _profile_requests: return
+    name = f"!{(ctx.invoked_subcommand or ctx.command).qualified_name}"
+    if name in PROFILABLE_HANDLERS: ctx.profile_session = _start_profile(name)
+
+@bot.after_invoke
+async def finish_command_profile(ctx):
+    session = getattr(ctx, "profile_session", None)
+    if session is not None: _finish_profile(session)
+
 # =================================================================================
 # SECTION 1 : LOGIQUE POUR LA COMMANDE !STOCKS
 # =================================================================================
 async def log_stock_change(interaction: discord.Interaction, changes: list, action_type: str):
-    log_channel = bot.get_channel(STOCK_LOG_CHANNEL_ID)
+    record_stock_audit(interaction.guild_id, interaction.user.id, changes, action_type)
+    log_channel = get_config_channel(interaction.guild, "stock_log_channel_id")
     if not log_channel: return
     embed = discord.Embed(title=f"📝 Log de Modification des Stocks", description=f"**Action :** {action_type}\n**Auteur :** {interaction.user.mention}", color=discord.Color.blue(), timestamp=get_paris_time())
     for change in changes:
@@ -53,144 +270,136 @@ async def log_stock_change(interaction: discord.Interaction, changes: list, acti
     try: await log_channel.send(embed=embed)
     except discord.Forbidden: print(f"ERREUR: Permissions manquantes pour envoyer des logs de stock.")
 
-def load_stocks():
+def load_stocks(guild_id: int):
     try:
-        with open(STOCKS_PATH, "r", encoding="utf-8") as f: return json.load(f)
-    except FileNotFoundError: return get_default_stocks()
-def save_stocks(data):
-    with open(STOCKS_PATH, "w", encoding="utf-8") as f: json.dump(data, f, indent=4, ensure_ascii=False)
-def get_default_stocks():
+        with open(guild_path(guild_id, STOCKS_FILE), "r", encoding="utf-8") as f: return json.load(f)
+    except FileNotFoundError: return get_default_stocks(guild_id)
+def save_stocks(guild_id: int, data):
+    with open(guild_path(guild_id, STOCKS_FILE), "w", encoding="utf-8") as f: json.dump(data, f, indent=4, ensure_ascii=False)
+def get_default_stocks(guild_id: int):
     default_data = {"entrepot": {"petrole_non_raffine": 0}, "total": {"petrole_non_raffine": 0, "gazole": 0, "sp95": 0, "sp98": 0, "kerosene": 0}}
-    save_stocks(default_data); return default_data
-def create_stocks_embed():
-    data = load_stocks()
+    save_stocks(guild_id, default_data); return default_data
+@profiled
+def create_stocks_embed(guild_id: int):
+    data = load_stocks(guild_id)
     embed = discord.Embed(title="⛽ Suivi des stocks - TotalEnergies", color=0xFF7900)
     embed.add_field(name="📦 Entrepôt", value=f"Pétrole non raffiné : **{data.get('entrepot', {}).get('petrole_non_raffine', 0):,}**".replace(',', ' '), inline=False)
     total = data.get('total', {})
     embed.add_field(name="📊 Total", value=f"Pétrole non raffiné : **{total.get('petrole_non_raffine', 0):,}**".replace(',', ' '), inline=False)
     carburants_text = (f"Gazole: **{total.get('gazole', 0):,}** | SP95: **{total.get('sp95', 0):,}** | SP98: **{total.get('sp98', 0):,}** | Kérosène: **{total.get('kerosene', 0):,}**").replace(',', ' ')
     embed.add_field(name="Carburants disponibles", value=carburants_text, inline=False)
+    pump_totals = load_stock_ledger(guild_id)["totals"]
+    embed.add_field(name="⛽ En pompes", value=" | ".join(f"{fuel.capitalize()}: **{pump_totals.get(f'pompes/{fuel}', 0):,}**" for fuel in REFINED_FUELS).replace(',', ' '), inline=False)
     embed.set_footer(text=f"Dernière mise à jour le {format_paris_time(get_paris_time())}")
     embed.set_thumbnail(url="https://upload.wikimedia.org/wikipedia/fr/thumb/c/c8/TotalEnergies_logo.svg/1200px-TotalEnergies_logo.svg.png")
     return embed
 class TotalStockModal(Modal, title="Mettre à jour le stock Total"):
-    def __init__(self, original_message_id: int):
+    def __init__(self, guild_id: int, original_message_id: int):
         super().__init__()
         self.original_message_id = original_message_id
-        current_stocks = load_stocks().get("total", {})
+        current_stocks = load_stocks(guild_id).get("total", {})
         self.add_item(TextInput(label="Nouvelle quantité de Pétrole non raffiné", custom_id="petrole_non_raffine", default=str(current_stocks.get("petrole_non_raffine", 0))))
         self.add_item(TextInput(label="Nouvelle quantité de Gazole", custom_id="gazole", default=str(current_stocks.get("gazole", 0))))
         self.add_item(TextInput(label="Nouvelle quantité de SP95", custom_id="sp95", default=str(current_stocks.get("sp95", 0))))
         self.add_item(TextInput(label="Nouvelle quantité de SP98", custom_id="sp98", default=str(current_stocks.get("sp98", 0))))
         self.add_item(TextInput(label="Nouvelle quantité de Kérosène", custom_id="kerosene", default=str(current_stocks.get("kerosene", 0))))
+    @profiled
     async def on_submit(self, interaction: discord.Interaction):
         await interaction.response.defer(ephemeral=True)
-        data = load_stocks()
-        old_total_stocks = data.get("total", {}).copy()
-        changes = []
+        targets = {}
         for field in self.children:
-            try:
-                new_value = int(field.value)
-                if new_value < 0: await interaction.followup.send(f"⚠️ La quantité pour {field.custom_id} ne peut pas être négative.", ephemeral=True); return
-                old_value = old_total_stocks.get(field.custom_id, 0)
-                if new_value != old_value:
-                    changes.append({"item": f"Total - {field.custom_id}", "old": f"{old_value:,}".replace(',', ' '), "new": f"{new_value:,}".replace(',', ' ')})
-                data['total'][field.custom_id] = new_value
+            try: targets[f"total/{field.custom_id}"] = int(field.value)
             except ValueError: await interaction.followup.send(f"⚠️ La quantité pour {field.custom_id} doit être un nombre.", ephemeral=True); return
-        if changes:
-            await log_stock_change(interaction, changes, "Mise à jour groupée du stock 'Total'")
-            save_stocks(data)
-        try:
-            msg = await interaction.channel.fetch_message(self.original_message_id)
-            if msg: await msg.edit(embed=create_stocks_embed())
-            await interaction.followup.send("✅ Stock 'Total' mis à jour !", ephemeral=True)
-        except (discord.NotFound, discord.Forbidden): await interaction.followup.send("⚠️ Panneau mis à jour, mais l'actualisation automatique a échoué.", ephemeral=True)
+        result = commit_stock_adjustments(interaction.guild_id, targets, interaction.user.id)
+        await apply_stock_commit(interaction, result, "Mise à jour groupée du stock 'Total'", "stocks", self.original_message_id, "✅ Stock 'Total' mis à jour !")
 class StockModal(Modal):
     def __init__(self, category: str, carburant: str, original_message_id: int):
         self.category, self.carburant, self.original_message_id = category, carburant, original_message_id
         super().__init__(title=f"Mettre à jour : {carburant.replace('_', ' ').title()}")
     nouvelle_quantite = TextInput(label="Nouvelle quantité totale", placeholder="Ex: 5000")
+    @profiled
     async def on_submit(self, interaction: discord.Interaction):
         await interaction.response.defer(ephemeral=True)
         try: quantite = int(self.nouvelle_quantite.value)
         except ValueError: await interaction.followup.send("⚠️ La quantité doit être un nombre.", ephemeral=True); return
-        data = load_stocks()
-        if self.category not in data or self.carburant not in data[self.category]: await interaction.followup.send("❌ Erreur, catégorie ou carburant introuvable.", ephemeral=True); return
-        old_value = data[self.category][self.carburant]
-        if quantite != old_value:
-            data[self.category][self.carburant] = quantite
-            changes = [{"item": f"{self.category.title()} - {self.carburant}", "old": f"{old_value:,}".replace(',', ' '), "new": f"{quantite:,}".replace(',', ' ')}]
-            await log_stock_change(interaction, changes, "Mise à jour d'un stock")
-            save_stocks(data)
-        try:
-            msg = await interaction.channel.fetch_message(self.original_message_id)
-            if msg: await msg.edit(embed=create_stocks_embed())
-            await interaction.followup.send(f"✅ Stock mis à jour !", ephemeral=True)
-        except (discord.NotFound, discord.Forbidden): await interaction.followup.send("⚠️ Panneau mis à jour, mais l'actualisation automatique a échoué.", ephemeral=True)
+        result = commit_stock_adjustments(interaction.guild_id, {f"{self.category}/{self.carburant}": quantite}, interaction.user.id)
+        await apply_stock_commit(interaction, result, "Mise à jour d'un stock", "stocks", self.original_message_id, "✅ Stock mis à jour !")
 class CategorySelectView(View):
     def __init__(self, original_message_id: int): 
         super().__init__(timeout=180); self.original_message_id = original_message_id
     @discord.ui.button(label="📦 Entrepôt", style=discord.ButtonStyle.secondary)
+    @profiled
     async def entrepot_button(self, i: discord.Interaction, b: Button): await i.response.send_modal(StockModal("entrepot", "petrole_non_raffine", self.original_message_id))
     @discord.ui.button(label="📊 Total", style=discord.ButtonStyle.secondary)
-    async def total_button(self, i: discord.Interaction, b: Button): await i.response.send_modal(TotalStockModal(self.original_message_id))
+    @profiled
+    async def total_button(self, i: discord.Interaction, b: Button): await i.response.send_modal(TotalStockModal(i.guild_id, self.original_message_id))
 class ResetConfirmationView(View):
     def __init__(self, original_message_id: int): super().__init__(timeout=60); self.original_message_id = original_message_id
     @discord.ui.button(label="Confirmer", style=discord.ButtonStyle.danger)
+    @profiled
     async def confirm_button(self, i: discord.Interaction, b: Button):
-        await log_stock_change(i, [{"item": "Action Globale", "old": "Données actuelles", "new": "Tout à zéro"}], "Réinitialisation complète des stocks")
-        save_stocks(get_default_stocks())
-        try: 
-            msg = await i.channel.fetch_message(self.original_message_id)
-            if msg: await msg.edit(embed=create_stocks_embed())
-        except (discord.NotFound, discord.Forbidden): pass
-        await i.response.edit_message(content="✅ Stocks remis à zéro.", view=None)
+        targets = {bucket: 0 for bucket, _ in iter_stock_buckets(load_stocks(i.guild_id), {})}
+        error, changes = commit_stock_adjustments(i.guild_id, targets, i.user.id)
+        if changes: await log_stock_change(i, changes, "Réinitialisation complète des stocks")
+        register_stock_panel(i.guild_id, "stocks", i.channel_id, self.original_message_id); await refresh_stock_panels(i.guild)
+        await i.response.edit_message(content=f"⚠️ {error}" if error else "✅ Stocks remis à zéro.", view=None)
     @discord.ui.button(label="Annuler", style=discord.ButtonStyle.secondary)
+    @profiled
     async def cancel_button(self, i: discord.Interaction, b: Button): await i.response.edit_message(content="Opération annulée.", view=None)
 class StockView(View):
     def __init__(self): super().__init__(timeout=None)
     @discord.ui.button(label="Mettre à jour", style=discord.ButtonStyle.success, custom_id="update_stock")
+    @profiled
     async def update_button(self, i: discord.Interaction, b: Button): await i.response.send_message(content="Catégorie à modifier ?", view=CategorySelectView(i.message.id), ephemeral=True)
     @discord.ui.button(label="Rafraîchir", style=discord.ButtonStyle.primary, custom_id="refresh_stock")
-    async def refresh_button(self, i: discord.Interaction, b: Button): await i.response.edit_message(embed=create_stocks_embed(), view=self)
+    @profiled
+    async def refresh_button(self, i: discord.Interaction, b: Button): await i.response.edit_message(embed=create_stocks_embed(i.guild_id), view=self)
     @discord.ui.button(label="Tout remettre à 0", style=discord.ButtonStyle.danger, custom_id="reset_all_stock")
+    @profiled
     async def reset_button(self, i: discord.Interaction, b: Button): await i.response.send_message(content="**⚠️ Action irréversible. Confirmer ?**", view=ResetConfirmationView(i.message.id), ephemeral=True)
+    @discord.ui.button(label="Mouvement", style=discord.ButtonStyle.secondary, custom_id="stock_movement")
+    @profiled
+    async def movement_button(self, i: discord.Interaction, b: Button): await i.response.send_modal(StockMovementModal(i.message.id, "stocks"))
 @bot.command(name="stocks")
-async def stocks(ctx): await ctx.send(embed=create_stocks_embed(), view=StockView())
+async def stocks(ctx):
+    msg = await ctx.send(embed=create_stocks_embed(ctx.guild.id), view=StockView())
+    register_stock_panel(ctx.guild.id, "stocks", msg.channel.id, msg.id)
 
 # =================================================================================
 # SECTION 2 : LOGIQUE POUR LA COMMANDE !STATIONS (CORRIGÉE)
 # =================================================================================
-def load_locations():
+PUMP_MAX_CAPACITY = {"gazole": 3000, "sp95": 2000, "sp98": 2000, "kerosene": 10000}
+
+def load_locations(guild_id: int):
     try:
-        with open(LOCATIONS_PATH, "r", encoding="utf-8") as f: return json.load(f)
-    except FileNotFoundError: return get_default_locations()
+        with open(guild_path(guild_id, LOCATIONS_FILE), "r", encoding="utf-8") as f: return json.load(f)
+    except FileNotFoundError: return get_default_locations(guild_id)
 
-def save_locations(data):
-    with open(LOCATIONS_PATH, "w", encoding="utf-8") as f: json.dump(data, f, indent=4, ensure_ascii=False)
+def save_locations(guild_id: int, data):
+    with open(guild_path(guild_id, LOCATIONS_FILE), "w", encoding="utf-8") as f: json.dump(data, f, indent=4, ensure_ascii=False)
 
-def get_default_locations():
+def get_default_locations(guild_id: int):
     default_data = {"stations": {"Station de Lampaul": {"image_url": "","last_updated": "N/A", "pumps": {"Pompe 1": {"gazole": 0, "sp95": 0, "sp98": 0}, "Pompe 2": {"gazole": 0, "sp95": 0, "sp98": 0}, "Pompe 3": {"gazole": 0, "sp95": 0, "sp98": 0}}}, "Station de Ligoudou": {"image_url": "","last_updated": "N/A", "pumps": {"Pompe 1": {"gazole": 0, "sp95": 0, "sp98": 0}, "Pompe 2": {"gazole": 0, "sp95": 0, "sp98": 0}}}},"ports": {"Port de Lampaul": {"image_url": "","last_updated": "N/A", "pumps": {"Pompe 1": {"gazole": 0, "sp95": 0, "sp98": 0}}}, "Port de Ligoudou": {"image_url": "","last_updated": "N/A", "pumps": {"Pompe 1": {"gazole": 0, "sp95": 0, "sp98": 0}}}},"aeroport": {"Aéroport": {"image_url": "","last_updated": "N/A", "pumps": {"Pompe 1": {"kerosene": 0}}}}}
-    save_locations(default_data); return default_data
+    save_locations(guild_id, default_data); return default_data
 
-def create_locations_embeds():
-    data = load_locations()
+@profiled
+def create_locations_embeds(guild_id: int):
+    data = load_locations(guild_id)
     embeds = []
     categories = {"stations": "🚉 Stations", "ports": "⚓ Ports", "aeroport": "✈️ Aéroport"}
-    MAX_CAPACITY = {"gazole": 3000, "sp95": 2000, "sp98": 2000, "kerosene": 10000}
-    global_missing = {fuel: 0 for fuel in MAX_CAPACITY.keys()}
+    global_missing = {fuel: 0 for fuel in PUMP_MAX_CAPACITY.keys()}
     for cat_key, cat_name in categories.items():
         locations = data.get(cat_key)
         if not locations: continue
         cat_embed = discord.Embed(title=f"**{cat_name}**", color=0x0099ff)
         image_set = False
-        total_missing_in_cat = {fuel: 0 for fuel in MAX_CAPACITY.keys()}
+        total_missing_in_cat = {fuel: 0 for fuel in PUMP_MAX_CAPACITY.keys()}
         for loc_name, loc_data in locations.items():
             pump_text = ""
             for pump_name, pump_fuels in loc_data.get("pumps", {}).items():
                 pump_text += f"🔧 **{pump_name.upper()}**\n"
                 for fuel, qty in pump_fuels.items():
-                    max_cap = MAX_CAPACITY.get(fuel, 0)
+                    max_cap = PUMP_MAX_CAPACITY.get(fuel, 0)
                     missing = max(0, max_cap - qty)
                     total_missing_in_cat[fuel] += missing
                     global_missing[fuel] += missing
@@ -221,17 +430,14 @@ class LocationUpdateModal(Modal):
         self.category_key, self.location_name, self.pump_name, self.original_message_id = category_key, location_name, pump_name, original_message_id
         for fuel, qty in fuels_data.items(): 
             self.add_item(TextInput(label=f"Nouvelle Quantité pour {fuel.upper()}", custom_id=fuel, default=str(qty)))
+    @profiled
     async def on_submit(self, interaction: discord.Interaction):
-        await interaction.response.defer(ephemeral=True); data = load_locations(); pump_data = data[self.category_key][self.location_name]["pumps"][self.pump_name]
+        await interaction.response.defer(ephemeral=True); targets = {}
         for field in self.children:
-            try: pump_data[field.custom_id] = int(field.value)
+            try: targets[f"pompe/{self.category_key}/{self.location_name}/{self.pump_name}/{field.custom_id}"] = int(field.value)
             except ValueError: await interaction.followup.send(f"⚠️ La quantité pour {field.custom_id.upper()} doit être un nombre.", ephemeral=True); return
-        data[self.category_key][self.location_name]["last_updated"] = format_paris_time(get_paris_time()); save_locations(data)
-        try:
-            msg = await interaction.channel.fetch_message(self.original_message_id)
-            if msg: await msg.edit(embeds=create_locations_embeds())
-            await interaction.followup.send("✅ Pompe mise à jour !", ephemeral=True)
-        except (discord.NotFound, discord.Forbidden): await interaction.followup.send("⚠️ Pompe mise à jour, mais l'actualisation automatique a échoué.", ephemeral=True)
+        result = commit_stock_adjustments(interaction.guild_id, targets, interaction.user.id)
+        await apply_stock_commit(interaction, result, "Relevé d'une pompe", "stations", self.original_message_id, "✅ Pompe mise à jour !")
 
 class PumpSelectView(View):
     def __init__(self, category_key: str, location_name: str, original_message_id: int, locations_data: dict):
@@ -240,6 +446,7 @@ class PumpSelectView(View):
         pumps = list(self.locations_data[category_key][location_name].get("pumps", {}).keys()); options = [SelectOption(label=p) for p in pumps]
         self.children[0].options = options if pumps else [SelectOption(label="Aucune pompe trouvée", value="disabled")]
     @discord.ui.select(placeholder="Choisis une pompe...", custom_id="locations_pump_selector")
+    @profiled
     async def select_callback(self, i: discord.Interaction, select: Select):
         pump_name = select.values[0]
         if pump_name != "disabled":
@@ -253,6 +460,7 @@ class LocationSelectView(View):
         locations = list(self.locations_data.get(category_key, {}).keys()); options = [SelectOption(label=loc) for loc in locations]
         self.children[0].options = options if locations else [SelectOption(label="Aucun lieu trouvé", value="disabled")]
     @discord.ui.select(placeholder="Choisis un lieu...", custom_id="locations_loc_selector")
+    @profiled
     async def select_callback(self, interaction: discord.Interaction, select: Select):
         loc_name = select.values[0]
         if loc_name == "disabled": await interaction.response.edit_message(content="Action annulée.", view=None); return
@@ -285,43 +493,54 @@ class LocationCategorySelectView(View):
             await interaction.response.edit_message(content="Choisis un lieu :", view=LocationSelectView(category_key, self.original_message_id, self.locations_data))
 
     @discord.ui.button(label="Stations", style=discord.ButtonStyle.secondary)
+    @profiled
     async def stations_button(self, i: discord.Interaction, b: Button): await self.show_location_select(i, "stations")
     @discord.ui.button(label="Ports", style=discord.ButtonStyle.secondary)
+    @profiled
     async def ports_button(self, i: discord.Interaction, b: Button): await self.show_location_select(i, "ports")
     @discord.ui.button(label="Aéroport", style=discord.ButtonStyle.secondary)
+    @profiled
     async def aeroport_button(self, i: discord.Interaction, b: Button): await self.show_location_select(i, "aeroport")
 
 class LocationsView(View):
     def __init__(self): super().__init__(timeout=None)
     @discord.ui.button(label="Mettre à jour", style=discord.ButtonStyle.primary, custom_id="update_location")
+    @profiled
     async def update_button(self, i: discord.Interaction, b: Button):
         await i.response.defer(ephemeral=True, thinking=True)
-        locations_data = load_locations()
+        locations_data = load_locations(i.guild_id)
         view = LocationCategorySelectView(i.message.id, locations_data)
         await i.followup.send("Choisis une catégorie :", view=view, ephemeral=True)
     @discord.ui.button(label="Rafraîchir", style=discord.ButtonStyle.secondary, custom_id="refresh_locations")
-    async def refresh_button(self, i: discord.Interaction, b: Button): await i.response.edit_message(embeds=create_locations_embeds(), view=self)
+    @profiled
+    async def refresh_button(self, i: discord.Interaction, b: Button): await i.response.edit_message(embeds=create_locations_embeds(i.guild_id), view=self)
+    @discord.ui.button(label="Remplir une pompe", style=discord.ButtonStyle.success, custom_id="locations_stock_movement")
+    @profiled
+    async def movement_button(self, i: discord.Interaction, b: Button): await i.response.send_modal(StockMovementModal(i.message.id, "stations"))
 
 @bot.command(name="stations")
-async def stations(ctx): await ctx.send(embeds=create_locations_embeds(), view=LocationsView())
+async def stations(ctx):
+    msg = await ctx.send(embeds=create_locations_embeds(ctx.guild.id), view=LocationsView())
+    register_stock_panel(ctx.guild.id, "stations", msg.channel.id, msg.id)
 # =================================================================================
 # SECTION 3 : LOGIQUE POUR LA COMMANDE !ANNUAIRE
 # =================================================================================
-def load_annuaire():
+def load_annuaire(guild_id: int):
     try:
-        with open(ANNUAIRE_PATH, "r", encoding="utf-8") as f: return json.load(f)
+        with open(guild_path(guild_id, ANNUAIRE_FILE), "r", encoding="utf-8") as f: return json.load(f)
     except FileNotFoundError:
         default_data = {"Patron": [], "Co-Patron": [], "Chef d'équipe": [], "Employé": []}
-        save_annuaire(default_data); return default_data
-def save_annuaire(data):
-    with open(ANNUAIRE_PATH, "w", encoding="utf-8") as f: json.dump(data, f, indent=4, ensure_ascii=False)
+        save_annuaire(guild_id, default_data); return default_data
+def save_annuaire(guild_id: int, data):
+    with open(guild_path(guild_id, ANNUAIRE_FILE), "w", encoding="utf-8") as f: json.dump(data, f, indent=4, ensure_ascii=False)
+@profiled
 async def create_annuaire_embed(guild: discord.Guild):
-    saved_data = load_annuaire(); embed = discord.Embed(title="📞 Annuaire Téléphonique", color=discord.Color.blue())
+    saved_data = load_annuaire(guild.id); embed = discord.Embed(title="📞 Annuaire Téléphonique", color=discord.Color.blue())
     role_priority = ["Patron", "Co-Patron", "Chef d'équipe", "Employé"]
     role_icons = {"Patron": "👑", "Co-Patron": "⭐", "Chef d'équipe": "📋", "Employé": "👨‍💼"}
     grouped_members = {role_name: [] for role_name in role_priority}
-    for member in guild.members:
-        if member.bot: continue
+    absent_ids = get_absent_member_ids(guild.id)
+    for member in member_cache.staff_members(guild):
         highest_role_name = next((name for name in role_priority if discord.utils.get(member.roles, name=name)), None)
         if highest_role_name: grouped_members[highest_role_name].append(member)
     for role_name in role_priority:
@@ -330,77 +549,80 @@ async def create_annuaire_embed(guild: discord.Guild):
         value_str = ""
         for member in sorted(members_in_group, key=lambda m: m.display_name):
             number = next((user.get('number') for users in saved_data.values() for user in users if user['id'] == member.id), None)
-            value_str += f"• {member.display_name} → {'`' + number + '`' if number else ' Pas encore renseigné'}\n"
+            value_str += f"• {member.display_name} → {'`' + number + '`' if number else ' Pas encore renseigné'}{' · 🏖️ *absent(e)*' if member.id in absent_ids else ''}\n"
         if value_str: embed.add_field(name=f"{role_icons[role_name]} {role_name}", value=value_str, inline=False)
     embed.set_footer(text=f"Mis à jour le {get_paris_time()}"); return embed
 class AnnuaireModal(Modal):
     def __init__(self, current_number: str = ""):
         super().__init__(title="Mon numéro de téléphone")
         self.add_item(TextInput(label="Ton numéro (laisse vide pour supprimer)", placeholder="Ex: 0612345678", required=False, default=current_number))
+    @profiled
     async def on_submit(self, interaction: discord.Interaction):
         await interaction.response.defer(ephemeral=True)
-        number = self.children[0].value.strip(); data, user = load_annuaire(), interaction.user
+        number = self.children[0].value.strip(); data, user = load_annuaire(interaction.guild_id), interaction.user
         for role_group in data.values(): role_group[:] = [entry for entry in role_group if entry['id'] != user.id]
         role_priority = ["Patron", "Co-Patron", "Chef d'équipe", "Employé"]
         user_role_name = next((name for name in role_priority if discord.utils.get(user.roles, name=name)), None)
         if user_role_name and number: data.setdefault(user_role_name, []).append({"id": user.id, "name": user.display_name, "number": number})
-        save_annuaire(data)
+        save_annuaire(interaction.guild_id, data)
         try:
             async for message in interaction.channel.history(limit=100):
                 if message.author == bot.user and message.embeds and message.embeds[0].title == "📞 Annuaire Téléphonique":
-                    await message.edit(embed=await create_annuaire_embed(interaction.guild)); break
+                    edit_queue.submit(message, embed=await create_annuaire_embed(interaction.guild)); break
             await interaction.followup.send("✅ Ton numéro a été mis à jour !", ephemeral=True)
         except (discord.NotFound, discord.Forbidden): await interaction.followup.send("✅ Ton numéro est sauvegardé, mais le panneau n'a pas pu être actualisé.", ephemeral=True)
 class AnnuaireView(View):
     def __init__(self): super().__init__(timeout=None)
     @discord.ui.button(label="Saisir / Modifier mon numéro", style=discord.ButtonStyle.primary, custom_id="update_annuaire_number")
+    @profiled
     async def update_number_button(self, interaction: discord.Interaction, button: Button):
-        data = load_annuaire(); current_number = next((user.get('number', '') for group in data.values() for user in group if user['id'] == interaction.user.id), "")
+        data = load_annuaire(interaction.guild_id); current_number = next((user.get('number', '') for group in data.values() for user in group if user['id'] == interaction.user.id), "")
         await interaction.response.send_modal(AnnuaireModal(current_number=current_number))
     @discord.ui.button(label="Demander d'actualiser", style=discord.ButtonStyle.secondary, custom_id="request_annuaire_update")
+    @profiled
     async def request_update_button(self, interaction: discord.Interaction, button: Button):
         await interaction.response.defer(ephemeral=True)
-        saved_data = load_annuaire(); all_registered_ids = {user['id'] for group in saved_data.values() for user in group if user.get('number')}
+        saved_data = load_annuaire(interaction.guild_id); all_registered_ids = {user['id'] for group in saved_data.values() for user in group if user.get('number')}
         role_priority = ["Patron", "Co-Patron", "Chef d'équipe", "Employé"]; options = []
         for role_name in role_priority:
-            role = discord.utils.get(interaction.guild.roles, name=role_name)
-            if role:
-                for member in role.members:
-                    if not member.bot and member.id not in all_registered_ids:
-                        options.append(SelectOption(label=member.display_name, value=str(member.id)))
+            for member in member_cache.staff_members(interaction.guild):
+                if member.id not in all_registered_ids and discord.utils.get(member.roles, name=role_name):
+                    options.append(SelectOption(label=member.display_name, value=str(member.id)))
         options = list({opt.value: opt for opt in options}.values()); placeholder = "Qui notifier pour renseigner son numéro ?"
         if len(options) > 25: options = options[:25]; placeholder = "Qui notifier ? (25 premiers)"
         if not options: await interaction.followup.send("🎉 Tout le monde a renseigné son numéro !", ephemeral=True); return
         select_menu = Select(placeholder=placeholder, options=options)
         async def select_callback(select_interaction: discord.Interaction):
             await select_interaction.response.defer(ephemeral=True); user_id_to_notify = select_interaction.data["values"][0]
-            report_channel = bot.get_channel(REPORT_CHANNEL_ID)
+            report_channel = get_config_channel(select_interaction.guild, "report_channel_id")
             if not report_channel: await select_interaction.followup.send("❌ Erreur : Salon de signalement non trouvé.", ephemeral=True); return
             try:
-                member_to_notify = await select_interaction.guild.fetch_member(int(user_id_to_notify))
-                annuaire_link = f"https://discord.com/channels/{select_interaction.guild.id}/{ANNUAIRE_CHANNEL_ID}"
+                member_to_notify = await member_cache.resolve(select_interaction.guild, int(user_id_to_notify), "annuaire_notify")
+                annuaire_link = f"https://discord.com/channels/{select_interaction.guild.id}/{get_guild_config(select_interaction.guild.id).get('annuaire_channel_id')}"
                 await report_channel.send(f"Bonjour {member_to_notify.mention}, il semble que tu n'aies pas encore renseigné ton numéro. Merci de le faire ici : {annuaire_link}")
                 await select_interaction.edit_original_response(content=f"✅ {member_to_notify.display_name} a été notifié(e).", view=None)
             except (discord.NotFound, discord.Forbidden): await select_interaction.followup.send("❌ Erreur lors de la notification.", ephemeral=True)
         select_menu.callback = select_callback; temp_view = View(timeout=180); temp_view.add_item(select_menu)
         await interaction.followup.send(view=temp_view, ephemeral=True)
     @discord.ui.button(label="Rafraîchir", style=discord.ButtonStyle.secondary, custom_id="refresh_annuaire")
+    @profiled
     async def refresh_button(self, i: discord.Interaction, b: Button): await i.response.edit_message(embed=await create_annuaire_embed(i.guild), view=self)
     @discord.ui.button(label="Signaler numéro invalide", style=discord.ButtonStyle.danger, custom_id="report_annuaire_number")
+    @profiled
     async def report_number_button(self, interaction: discord.Interaction, b: Button):
         await interaction.response.defer(ephemeral=True)
-        saved_data = load_annuaire(); all_users = [SelectOption(label=u['name'], value=str(u['id'])) for rg in saved_data.values() for u in rg if u.get('number')]
+        saved_data = load_annuaire(interaction.guild_id); all_users = [SelectOption(label=u['name'], value=str(u['id'])) for rg in saved_data.values() for u in rg if u.get('number')]
         placeholder = "Qui veux-tu signaler ?";
         if len(all_users) > 25: all_users = all_users[:25]; placeholder = "Qui veux-tu signaler ? (25 premiers)"
         if not all_users: await interaction.followup.send("Personne n'a de numéro à signaler pour l'instant.", ephemeral=True); return
         select_menu = Select(placeholder=placeholder, options=all_users)
         async def select_callback(select_interaction: discord.Interaction):
             await select_interaction.response.defer(ephemeral=True); user_id_to_report = select_interaction.data["values"][0]
-            report_channel = bot.get_channel(REPORT_CHANNEL_ID)
+            report_channel = get_config_channel(select_interaction.guild, "report_channel_id")
             if not report_channel: await select_interaction.followup.send("❌ Erreur : Salon de signalement non trouvé.", ephemeral=True); return
             try:
-                member_to_report = await select_interaction.guild.fetch_member(int(user_id_to_report))
-                annuaire_link = f"https://discord.com/channels/{select_interaction.guild.id}/{ANNUAIRE_CHANNEL_ID}"
+                member_to_report = await member_cache.resolve(select_interaction.guild, int(user_id_to_report), "annuaire_report")
+                annuaire_link = f"https://discord.com/channels/{select_interaction.guild.id}/{get_guild_config(select_interaction.guild.id).get('annuaire_channel_id')}"
                 await report_channel.send(f"Bonjour {member_to_report.mention}, ton numéro dans l'annuaire semble incorrect. Merci de le mettre à jour ici : {annuaire_link}")
                 await select_interaction.edit_original_response(content=f"✅ {member_to_report.display_name} a été notifié(e).", view=None)
             except (discord.NotFound, discord.Forbidden): await select_interaction.followup.send("❌ Erreur lors de la notification.", ephemeral=True)
@@ -413,33 +635,126 @@ async def annuaire(ctx): await ctx.send(embed=await create_annuaire_embed(ctx.gu
 # =================================================================================
 # SECTION 4 : LOGIQUE POUR LA COMMANDE !ABSENCE
 # =================================================================================
+def load_absences(guild_id: int):
+    try:
+        with open(guild_path(guild_id, ABSENCES_FILE), "r", encoding="utf-8") as f: return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError): return []
+
+def save_absences(guild_id: int, data):
+    with open(guild_path(guild_id, ABSENCES_FILE), "w", encoding="utf-8") as f: json.dump(data, f, indent=4, ensure_ascii=False)
+    _absence_indexes[guild_id] = AbsenceIndex(data)
+
+def parse_absence_date(text: str):
+    """Convertit une saisie (JJ/MM/AAAA, JJ/MM/AA, "aujourd'hui", "demain") en date du calendrier de Paris."""
+    cleaned = text.strip().lower().replace("-", "/").replace(".", "/")
+    today = get_paris_time().date()
+    if cleaned in ("aujourd'hui", "aujourdhui", "auj"): return today
+    if cleaned == "demain": return today + timedelta(days=1)
+    for fmt in ("%d/%m/%Y", "%d/%m/%y"):
+        try: return datetime.strptime(cleaned, fmt).date()
+        except ValueError: continue
+    return None
+
+def format_absence_date(iso_date: str):
+    return datetime.strptime(iso_date, "%Y-%m-%d").strftime("%d/%m/%Y")
+
+class AbsenceIndex:
+    """Arbre de segments sur les absences triées par date de début, augmenté de la date de fin maximale de chaque sous-arbre.
+    Les dates sont stockées au format ISO (AAAA-MM-JJ), donc comparables comme des chaînes."""
+    def __init__(self, absences: list):
+        self.entries = sorted(absences, key=lambda a: (a["start"], a["end"]))
+        self.starts = [a["start"] for a in self.entries]
+        self.size = 1
+        while self.size < len(self.entries): self.size *= 2
+        self.max_end = [""] * (2 * self.size)
+        for pos, absence in enumerate(self.entries): self.max_end[self.size + pos] = absence["end"]
+        for node in range(self.size - 1, 0, -1): self.max_end[node] = max(self.max_end[2 * node], self.max_end[2 * node + 1])
+    def overlapping(self, start: str, end: str):
+        """Absences dont l'intervalle [début, fin] chevauche [start, end] : O(log n + k)."""
+        results = []
+        self._collect(1, 0, self.size, bisect_right(self.starts, end), start, results)
+        return results
+    def absent_on(self, day: str): return self.overlapping(day, day)
+    def _collect(self, node: int, lo: int, hi: int, limit: int, start: str, results: list):
+        if lo >= limit or self.max_end[node] < start: return
+        if hi - lo == 1: results.append(self.entries[lo]); return
+        mid = (lo + hi) // 2
+        self._collect(2 * node, lo, mid, limit, start, results)
+        self._collect(2 * node + 1, mid, hi, limit, start, results)
+
+_absence_indexes = {} # Un index par serveur : une déclaration n'invalide que l'index de son propre serveur
+def get_absence_index(guild_id: int):
+    if guild_id not in _absence_indexes: _absence_indexes[guild_id] = AbsenceIndex(load_absences(guild_id))
+    return _absence_indexes[guild_id]
+
+def get_absent_member_ids(guild_id: int, day=None):
+    day = day or get_paris_time().date()
+    return {absence["user_id"] for absence in get_absence_index(guild_id).absent_on(day.isoformat())}
+
+def create_absents_embed(guild: discord.Guild, start, end, title: str):
+    absences = sorted(get_absence_index(guild.id).overlapping(start.isoformat(), end.isoformat()), key=lambda a: (a["start"], a["name"].lower()))
+    embed = discord.Embed(title=title, color=discord.Color.orange())
+    lines = []
+    for absence in absences:
+        member = member_cache.get(guild, absence["user_id"])
+        name = member.display_name if member else absence["name"]
+        motif = absence.get("motif", "")
+        if len(motif) > 60: motif = motif[:57] + "..."
+        lines.append(f"• **{name}** → du {format_absence_date(absence['start'])} au {format_absence_date(absence['end'])}" + (f" *({motif})*" if motif else ""))
+    description = "\n".join(lines) if lines else "✅ Aucune absence déclarée sur cette période."
+    if len(description) > 4000: description = description[:3990] + "\n…"
+    embed.description = description
+    embed.set_footer(text=f"{len(absences)} absence(s) - Mis à jour le {format_paris_time(get_paris_time())}")
+    return embed
+
 class AbsenceModal(Modal, title="Déclarer une absence"):
     date_debut = TextInput(label="🗓️ Date de début", placeholder="Ex: 10/10/2025")
     date_fin = TextInput(label="🗓️ Date de fin", placeholder="Ex: 12/10/2025")
     motif = TextInput(label="📝 Motif", style=discord.TextStyle.paragraph, placeholder="Raison de votre absence...", max_length=1000)
+    @profiled
     async def on_submit(self, interaction: discord.Interaction):
-        absence_channel = bot.get_channel(ABSENCE_CHANNEL_ID)
+        start, end = parse_absence_date(self.date_debut.value), parse_absence_date(self.date_fin.value)
+        if not start or not end:
+            await interaction.response.send_message("⚠️ Les dates doivent être au format JJ/MM/AAAA (ex: 10/10/2025).", ephemeral=True); return
+        if end < start:
+            await interaction.response.send_message("⚠️ La date de fin doit être postérieure ou égale à la date de début.", ephemeral=True); return
+        if (end - start).days + 1 > MAX_ABSENCE_DAYS:
+            await interaction.response.send_message(f"⚠️ Une absence ne peut pas dépasser {MAX_ABSENCE_DAYS} jours.", ephemeral=True); return
+        absence_channel = get_config_channel(interaction.guild, "absence_channel_id")
         if not absence_channel:
             await interaction.response.send_message("❌ Erreur : Le salon des absences n'est pas configuré ou introuvable.", ephemeral=True); return
+        nb_days = (end - start).days + 1
         embed = discord.Embed(title=f"📋 Déclaration d'absence de {interaction.user.display_name}", color=discord.Color.orange())
         embed.set_thumbnail(url=interaction.user.display_avatar.url)
-        embed.add_field(name="Date de début", value=self.date_debut.value, inline=True)
-        embed.add_field(name="Date de fin", value=self.date_fin.value, inline=True)
+        embed.add_field(name="Date de début", value=start.strftime("%d/%m/%Y"), inline=True)
+        embed.add_field(name="Date de fin", value=end.strftime("%d/%m/%Y"), inline=True)
+        embed.add_field(name="Durée", value=f"{nb_days} jour(s)", inline=True)
         embed.add_field(name="Motif", value=self.motif.value, inline=False)
-        embed.set_footer(text=f"Déclaration faite le {get_paris_time()}")
+        embed.set_footer(text=f"Déclaration faite le {format_paris_time(get_paris_time())}")
         try:
             await absence_channel.send(embed=embed)
-            await interaction.response.send_message("✅ Ton absence a bien été enregistrée.", ephemeral=True)
         except discord.Forbidden:
-            await interaction.response.send_message("❌ Erreur : Je n'ai pas les permissions pour envoyer un message dans le salon des absences.", ephemeral=True)
+            await interaction.response.send_message("❌ Erreur : Je n'ai pas les permissions pour envoyer un message dans le salon des absences.", ephemeral=True); return
+        absences = load_absences(interaction.guild_id)
+        absences.append({"user_id": interaction.user.id, "name": interaction.user.display_name, "start": start.isoformat(), "end": end.isoformat(), "motif": self.motif.value, "declared_at": format_paris_time(get_paris_time())})
+        save_absences(interaction.guild_id, absences)
+        await interaction.response.send_message("✅ Ton absence a bien été enregistrée.", ephemeral=True)
 class AbsenceView(View):
     def __init__(self): super().__init__(timeout=None)
     @discord.ui.button(label="Déclarer une absence", style=discord.ButtonStyle.primary, custom_id="declare_absence")
+    @profiled
     async def declare_button(self, interaction: discord.Interaction, button: Button): await interaction.response.send_modal(AbsenceModal())
 @bot.command(name="absence")
 async def absence(ctx):
     embed = discord.Embed(title="Gestion des Absences", description="Clique sur le bouton ci-dessous pour déclarer une nouvelle absence.", color=discord.Color.dark_grey())
     await ctx.send(embed=embed, view=AbsenceView())
+@bot.hybrid_command(name="absents", description="Liste les membres absents à une date (ou sur une période).")
+async def absents(ctx, date: str = "aujourd'hui", fin: str = None):
+    start = parse_absence_date(date); end = parse_absence_date(fin) if fin else start
+    if not start or not end: await ctx.send("⚠️ Les dates doivent être au format JJ/MM/AAAA (ex: 10/10/2025).", ephemeral=True); return
+    if end < start: await ctx.send("⚠️ La date de fin doit être postérieure ou égale à la date de début.", ephemeral=True); return
+    title = f"🗓️ Absents le {start.strftime('%d/%m/%Y')}" if start == end else f"🗓️ Absents du {start.strftime('%d/%m/%Y')} au {end.strftime('%d/%m/%Y')}"
+    await ctx.send(embed=create_absents_embed(ctx.guild, start, end, title), ephemeral=True)
 
 
 # =================================================================================
@@ -447,7 +762,9 @@ async def absence(ctx):
 # =================================================================================
 @bot.command(name="radio")
 async def radio(ctx):
-    embed = discord.Embed(title=f"Notre fréquence est `{RADIO_FREQUENCY}`", description="⚠️ Merci de la tenir secrète !", color=discord.Color.dark_grey())
+    frequency = get_guild_config(ctx.guild.id).get("radio_frequency")
+    if not frequency: await ctx.send("❌ Aucune fréquence radio n'est configurée pour ce serveur."); return
+    embed = discord.Embed(title=f"Notre fréquence est `{frequency}`", description="⚠️ Merci de la tenir secrète !", color=discord.Color.dark_grey())
     await ctx.send(embed=embed)
 
 
@@ -458,8 +775,9 @@ class AnnonceModal(Modal, title="Rédiger une annonce interne"):
     titre = TextInput(label="Titre de l'annonce", style=discord.TextStyle.short, max_length=256, required=True)
     paragraphe = TextInput(label="Contenu de l'annonce", style=discord.TextStyle.paragraph, max_length=2000, required=True)
     conclusion = TextInput(label="Conclusion (optionnel)", style=discord.TextStyle.short, required=False)
+    @profiled
     async def on_submit(self, interaction: discord.Interaction):
-        annonce_channel = bot.get_channel(ANNOUNCEMENT_CHANNEL_ID)
+        annonce_channel = get_config_channel(interaction.guild, "announcement_channel_id")
         if not annonce_channel:
             await interaction.response.send_message("❌ Erreur : Le salon des annonces est introuvable.", ephemeral=True); return
         user = interaction.user; role_priority = ["Patron", "Co-Patron", "Chef d'équipe", "Employé"]
@@ -476,6 +794,7 @@ class AnnonceModal(Modal, title="Rédiger une annonce interne"):
 class AnnonceView(View):
     def __init__(self): super().__init__(timeout=None)
     @discord.ui.button(label="Rédiger une annonce", style=discord.ButtonStyle.primary, custom_id="make_announcement")
+    @profiled
     async def announce_button(self, interaction: discord.Interaction, button: Button): await interaction.response.send_modal(AnnonceModal())
 
 @bot.command(name="annonce")
@@ -495,16 +814,17 @@ async def annonce_error(ctx, error):
 # SECTION 7 : LOGIQUE POUR LE PANEL FINANCIER
 # =================================================================================
 
-def load_recap_status():
+def load_recap_status(guild_id: int):
     try:
-        with open(RECAP_STATUS_PATH, "r") as f: return json.load(f)
+        with open(guild_path(guild_id, RECAP_STATUS_FILE), "r") as f: return json.load(f)
     except (FileNotFoundError, json.JSONDecodeError): return {"last_sent_week": 0}
 
-def save_recap_status(data):
-    with open(RECAP_STATUS_PATH, "w") as f: json.dump(data, f, indent=4)
+def save_recap_status(guild_id: int, data):
+    with open(guild_path(guild_id, RECAP_STATUS_FILE), "w") as f: json.dump(data, f, indent=4)
 
 async def log_finance_change(interaction: discord.Interaction, member: discord.Member, action_type: str, amount: str, details: str):
-    log_channel = bot.get_channel(FINANCE_LOG_CHANNEL_ID)
+    record_finance_audit(interaction.guild_id, interaction.user.id, member.id, action_type, amount, details)
+    log_channel = get_config_channel(interaction.guild, "finance_log_channel_id")
     if not log_channel: return
     color = discord.Color.green() if action_type == "Paiement" else (discord.Color.red() if "Retrait" in action_type else discord.Color.orange())
     embed = discord.Embed(title="💸 Log de Transaction Financière", description=f"**Auteur :** {interaction.user.mention}", color=color, timestamp=get_paris_time())
@@ -516,45 +836,48 @@ async def log_finance_change(interaction: discord.Interaction, member: discord.M
     try: await log_channel.send(embed=embed)
     except discord.Forbidden: print(f"ERREUR: Permissions manquantes pour les logs financiers.")
 
-def load_finances():
+def load_finances(guild_id: int):
     try:
-        with open(FINANCES_PATH, "r", encoding="utf-8") as f: return json.load(f)
+        with open(guild_path(guild_id, FINANCES_FILE), "r", encoding="utf-8") as f: return json.load(f)
     except (FileNotFoundError, json.JSONDecodeError): return {}
 
-def save_finances(data):
-    with open(FINANCES_PATH, "w", encoding="utf-8") as f: json.dump(data, f, indent=4, ensure_ascii=False)
+def save_finances(guild_id: int, data):
+    with open(guild_path(guild_id, FINANCES_FILE), "w", encoding="utf-8") as f: json.dump(data, f, indent=4, ensure_ascii=False)
 
-def add_to_history(member_id: int, action: str, amount_str: str, details: str = ""):
-    finances = load_finances()
+def add_to_history(guild_id: int, member_id: int, action: str, amount_str: str, details: str = ""):
+    finances = load_finances(guild_id)
     member_id_str = str(member_id)
     if member_id_str not in finances or "history" not in finances[member_id_str]:
         finances[member_id_str] = {**finances.get(member_id_str, {}), "history": []}
     log_entry = {"action": action, "details": details, "amount": amount_str, "timestamp": format_paris_time(get_paris_time())}
     finances[member_id_str]["history"].insert(0, log_entry)
     finances[member_id_str]["history"] = finances[member_id_str]["history"][:15]
-    save_finances(finances)
+    save_finances(guild_id, finances)
 
-async def update_summary_panels():
-    channel = bot.get_channel(BALANCES_SUMMARY_CHANNEL_ID)
+@profiled
+async def update_summary_panels(guild: discord.Guild):
+    channel = get_config_channel(guild, "balances_summary_channel_id")
     if not channel: return
     try:
-        balances_embed = await create_balances_summary_embed(channel.guild)
-        weekly_embed = await create_weekly_summary_embed(channel.guild)
+        balances_embed = await create_balances_summary_embed(guild)
+        weekly_embed = await create_weekly_summary_embed(guild)
         balances_msg_found, weekly_msg_found = False, False
         async for message in channel.history(limit=50):
             if message.author == bot.user and message.embeds:
                 if message.embeds[0].title == "📊 Récapitulatif des Soldes":
-                    await message.edit(embed=balances_embed); balances_msg_found = True
+                    edit_queue.submit(message, embed=balances_embed); balances_msg_found = True
                 elif message.embeds[0].title == "💸 Récapitulatif Hebdomadaire des Gains":
-                    await message.edit(embed=weekly_embed); weekly_msg_found = True
+                    edit_queue.submit(message, embed=weekly_embed); weekly_msg_found = True
             if balances_msg_found and weekly_msg_found: break
-    except Exception as e: print(f"Erreur màj auto panneaux financiers: {e}")
+    except discord.HTTPException as e: print(f"Erreur recherche des panneaux financiers ({guild.id}): {e}")
 
+@profiled
 def create_financial_embed(member: discord.Member):
-    finances = load_finances()
+    finances = load_finances(member.guild.id)
     member_id_str = str(member.id)
     if member_id_str not in finances:
-        finances[member_id_str] = {"solde": 0, "history": [], "weekly_earnings": 0, "current_week": 0}; save_finances(finances)
+        finances[member_id_str] = {"solde": 0, "history": [], "weekly_earnings": 0, "current_week": 0}; save_finances(member.guild.id, finances)
+        member_cache.pin(member.guild.id, member.id); member_cache.observe(member)
     solde = finances[member_id_str].get('solde', 0)
     solde_formatted = f"{solde:,.2f}".replace(',', ' ')
     embed_color = discord.Color.red() if solde > 0 else discord.Color.green()
@@ -571,15 +894,16 @@ def create_financial_embed(member: discord.Member):
     financial_embed.set_footer(text=f"Panel financier de {member.display_name}")
     return financial_embed
 
+@profiled
 async def create_balances_summary_embed(guild: discord.Guild):
     embed = discord.Embed(title="📊 Récapitulatif des Soldes", description="Aperçu des soldes actuels des employés.", color=discord.Color.gold())
-    finances = load_finances()
+    finances = load_finances(guild.id)
     if not finances: embed.description = "Aucune donnée financière trouvée."; return embed
     total_due = sum(data.get("solde", 0) for data in finances.values() if data.get("solde", 0) > 0)
     balance_lines = []
     for member_id, data in finances.items():
-        try: member_name = (await guild.fetch_member(int(member_id))).display_name
-        except (discord.NotFound, ValueError): member_name = f"Utilisateur Inconnu ({member_id})"
+        member = member_cache.get(guild, int(member_id)) if member_id.isdigit() else None
+        member_name = member.display_name if member else f"Utilisateur Inconnu ({member_id})"
         solde_formatted = f"{data.get('solde', 0):,.2f}".replace(',', ' ')
         balance_lines.append(f"• {member_name} → **`{solde_formatted} €`**")
     embed.description = "\n".join(balance_lines) if balance_lines else "Aucun employé n'a de solde."
@@ -588,17 +912,18 @@ async def create_balances_summary_embed(guild: discord.Guild):
     embed.set_footer(text=f"Dernière mise à jour le {format_paris_time(get_paris_time())}")
     return embed
 
+@profiled
 async def create_weekly_summary_embed(guild: discord.Guild):
     embed = discord.Embed(title="💸 Récapitulatif Hebdomadaire des Gains", description="Total des gains de chaque employé pour la semaine en cours (Lundi-Dimanche).", color=0x3498DB)
-    finances = load_finances()
+    finances = load_finances(guild.id)
     current_week = get_paris_time().isocalendar()[1]
     total_weekly_earnings = 0
     earning_lines = []
     for member_id, data in finances.items():
         display_earnings = data.get("weekly_earnings", 0) if data.get("current_week") == current_week else 0
         total_weekly_earnings += display_earnings
-        try: member_name = (await guild.fetch_member(int(member_id))).display_name
-        except (discord.NotFound, ValueError): member_name = f"Utilisateur Inconnu ({member_id})"
+        member = member_cache.get(guild, int(member_id)) if member_id.isdigit() else None
+        member_name = member.display_name if member else f"Utilisateur Inconnu ({member_id})"
         earnings_formatted = f"{display_earnings:,.2f}".replace(',', ' ')
         earning_lines.append(f"• {member_name} → **`{earnings_formatted} €`**")
     embed.description = "\n".join(earning_lines) if earning_lines else "Aucun gain enregistré cette semaine."
@@ -611,6 +936,7 @@ class DeclareTripModal(Modal, title="Déclarer un nouveau trajet"):
         super().__init__(); self.member, self.original_message = member, original_message
     trip_type = TextInput(label="Type de trajet (T1, T2, ou T3)", placeholder="Ex: T2", max_length=2, required=True)
     location = TextInput(label="Lieu (requis pour T3 : station ou export)", placeholder="Laissez vide si ce n'est pas un T3", required=False)
+    @profiled
     async def on_submit(self, interaction: discord.Interaction):
         await interaction.response.defer(ephemeral=True)
         ttype, loc, amount_to_add = self.trip_type.value.strip().upper(), self.location.value.strip().lower(), 0
@@ -620,56 +946,60 @@ class DeclareTripModal(Modal, title="Déclarer un nouveau trajet"):
             if loc not in ["station", "export"]: await interaction.followup.send("❌ Pour un T3, le lieu doit être `station` ou `export`.", ephemeral=True); return
             amount_to_add = 3200
         else: await interaction.followup.send("❌ Type de trajet invalide.", ephemeral=True); return
-        finances, member_id_str, current_week = load_finances(), str(self.member.id), get_paris_time().isocalendar()[1]
+        finances, member_id_str, current_week = load_finances(interaction.guild_id), str(self.member.id), get_paris_time().isocalendar()[1]
         user_data = finances.get(member_id_str, {"solde": 0, "weekly_earnings": 0, "current_week": 0, "history": []})
         if user_data.get("current_week") != current_week:
             user_data["weekly_earnings"] = 0; user_data["current_week"] = current_week
         user_data["solde"] += amount_to_add; user_data["weekly_earnings"] += amount_to_add
         finances[member_id_str] = user_data
-        save_finances(finances)
+        save_finances(interaction.guild_id, finances)
         details = f"{ttype} ({loc})" if ttype == "T3" else ttype
-        add_to_history(self.member.id, "Ajout Trajet", f"+{amount_to_add}€", details)
+        add_to_history(interaction.guild_id, self.member.id, "Ajout Trajet", f"+{amount_to_add}€", details)
         await log_finance_change(interaction, self.member, "Déclaration de Trajet", f"+{amount_to_add}€", details)
-        await self.original_message.edit(embed=create_financial_embed(self.member))
-        await update_summary_panels()
+        edit_queue.submit(self.original_message, embed=create_financial_embed(self.member))
+        await update_summary_panels(interaction.guild)
         await interaction.followup.send(f"✅ Trajet **{ttype}** de **{amount_to_add}€** ajouté à {self.member.display_name}.", ephemeral=True)
 
 class FinancialPanelView(View):
     def __init__(self): super().__init__(timeout=None)
     @discord.ui.button(label="Déclarer un trajet", style=discord.ButtonStyle.success, custom_id="declare_trip")
+    @profiled
     async def declare_trip_button(self, i: discord.Interaction, b: Button):
-        try: member = await i.guild.fetch_member(int(i.message.embeds[0].description.split('<@')[1].split('>')[0]))
+        try: member = await member_cache.resolve(i.guild, int(i.message.embeds[0].description.split('<@')[1].split('>')[0]), "financial_panel")
         except: await i.response.send_message("❌ Erreur : Employé lié introuvable.", ephemeral=True); return
         await i.response.send_modal(DeclareTripModal(member, i.message))
     @discord.ui.button(label="Payer", style=discord.ButtonStyle.primary, custom_id="pay_balance")
+    @profiled
     async def pay_button(self, i: discord.Interaction, b: Button):
         if not any(r.name in ["Patron", "Co-Patron"] for r in i.user.roles): await i.response.send_message("❌ Vous n'avez pas la permission.", ephemeral=True); return
         await i.response.defer(ephemeral=True)
-        try: member = await i.guild.fetch_member(int(i.message.embeds[0].description.split('<@')[1].split('>')[0]))
+        try: member = await member_cache.resolve(i.guild, int(i.message.embeds[0].description.split('<@')[1].split('>')[0]), "financial_panel")
         except: await i.followup.send("❌ Erreur : Employé lié introuvable.", ephemeral=True); return
-        finances, member_id_str = load_finances(), str(member.id)
+        finances, member_id_str = load_finances(i.guild_id), str(member.id)
         balance = finances.get(member_id_str, {}).get("solde", 0)
         if balance <= 0: await i.followup.send(f"ℹ️ Le solde de **{member.display_name}** est déjà à jour.", ephemeral=True); return
-        finances[member_id_str]["solde"] = 0; save_finances(finances)
-        add_to_history(member.id, "Paiement", f"-{balance}€", "Solde remis à zéro")
+        finances[member_id_str]["solde"] = 0; save_finances(i.guild_id, finances)
+        add_to_history(i.guild_id, member.id, "Paiement", f"-{balance}€", "Solde remis à zéro")
         await log_finance_change(i, member, "Paiement", f"-{balance}€", f"Le solde de {balance}€ a été réglé.")
-        await i.message.edit(embed=create_financial_embed(member))
-        await update_summary_panels()
+        edit_queue.submit(i.message, embed=create_financial_embed(member))
+        await update_summary_panels(i.guild)
         await i.followup.send(f"✅ Le solde de **{member.display_name}** a été payé.", ephemeral=True)
     @discord.ui.button(label="Historique", style=discord.ButtonStyle.secondary, custom_id="financial_history")
+    @profiled
     async def history_button(self, i: discord.Interaction, b: Button):
         await i.response.defer(ephemeral=True)
-        try: member = await i.guild.fetch_member(int(i.message.embeds[0].description.split('<@')[1].split('>')[0]))
+        try: member = await member_cache.resolve(i.guild, int(i.message.embeds[0].description.split('<@')[1].split('>')[0]), "financial_panel")
         except: await i.followup.send("❌ Erreur : Employé lié introuvable.", ephemeral=True); return
-        history = load_finances().get(str(member.id), {}).get("history", [])
+        history = load_finances(i.guild_id).get(str(member.id), {}).get("history", [])
         if not history: await i.followup.send("ℹ️ Aucun historique de transaction.", ephemeral=True); return
         embed = discord.Embed(title=f"📜 Historique de {member.display_name}", color=discord.Color.blue(), description="\n\n".join([f"`{e['timestamp']}`\n**{e['action']}**{(f' ({e['details']})' if e['details'] else '')} : `{e['amount']}`" for e in history[:10]]))
         embed.set_footer(text="Affiche les 10 dernières opérations.")
         await i.followup.send(embed=embed, ephemeral=True)
     @discord.ui.button(label="Rafraîchir", style=discord.ButtonStyle.secondary, custom_id="refresh_financial_panel", emoji="🔄")
+    @profiled
     async def refresh_button(self, i: discord.Interaction, b: Button):
         await i.response.defer()
-        try: member = await i.guild.fetch_member(int(i.message.embeds[0].description.split('<@')[1].split('>')[0]))
+        try: member = await member_cache.resolve(i.guild, int(i.message.embeds[0].description.split('<@')[1].split('>')[0]), "financial_panel")
         except: await i.followup.send("❌ Erreur : Employé lié introuvable.", ephemeral=True); return
         await i.edit_original_response(embed=create_financial_embed(member))
 class BalancesSummaryView(View):
@@ -683,15 +1013,16 @@ class OpenChannelModal(Modal, title="Ouvrir un salon privé"):
     first_name = TextInput(label="Prénom", placeholder="Prénom de l'utilisateur")
     last_name = TextInput(label="Nom", placeholder="Nom de l'utilisateur")
 
+    @profiled
     async def on_submit(self, interaction: discord.Interaction):
         await interaction.response.defer(ephemeral=True)
-        category = discord.utils.get(interaction.guild.categories, id=PRIVATE_CHANNEL_CATEGORY_ID)
-        if not category:
+        category = get_config_channel(interaction.guild, "private_channel_category_id")
+        if not isinstance(category, discord.CategoryChannel):
             await interaction.followup.send("❌ Erreur : Catégorie des salons privés introuvable.", ephemeral=True)
             return
             
         try:
-            member = await interaction.guild.fetch_member(int(self.member_id.value))
+            member = await member_cache.resolve(interaction.guild, int(self.member_id.value), "private_channel")
         except (ValueError, discord.NotFound):
             await interaction.followup.send("❌ Erreur : ID de membre invalide ou membre introuvable.", ephemeral=True)
             return
@@ -739,7 +1070,7 @@ class OpenChannelModal(Modal, title="Ouvrir un salon privé"):
             financial_embed = create_financial_embed(member)
             await new_channel.send(embed=financial_embed, view=FinancialPanelView())
 
-            await update_summary_panels()
+            await update_summary_panels(interaction.guild)
             await interaction.followup.send(f"✅ Salon {new_channel.mention} créé et {member.display_name} renommé.", ephemeral=True)
         except discord.Forbidden:
             await interaction.followup.send("❌ Erreur : Je n'ai pas la permission de créer un salon.", ephemeral=True)
@@ -749,56 +1080,120 @@ class OpenChannelInitView(View):
         super().__init__(timeout=None)
     
     @discord.ui.button(label="Créer un salon privé", style=discord.ButtonStyle.primary, custom_id="create_private_channel_btn")
+    @profiled
     async def open_modal_button(self, i: discord.Interaction, b: Button):
         await i.response.send_modal(OpenChannelModal())
 
 # =================================================================================
 # SECTION 9 : COMMANDE SETUP ET TÂCHE HEBDOMADAIRE
 # =================================================================================
-@tasks.loop(hours=1)
-async def weekly_recap_task():
-    await bot.wait_until_ready()
+async def send_weekly_recap(guild: discord.Guild):
     now = get_paris_time()
-    if now.weekday() != 6: return # 6 = Dimanche
     current_week = now.isocalendar()[1]
-    recap_status = load_recap_status()
-    if recap_status.get("last_sent_week", 0) >= current_week: return
-    log_channel = bot.get_channel(FINANCE_LOG_CHANNEL_ID)
+    if load_recap_status(guild.id).get("last_sent_week", 0) >= current_week: return
+    log_channel = get_config_channel(guild, "finance_log_channel_id")
     if not log_channel: return
-    recap_embed = await create_weekly_summary_embed(log_channel.guild)
+    recap_embed = await create_weekly_summary_embed(guild)
     recap_embed.title = f"Rapport des Gains - Semaine {current_week-1}"
     await log_channel.send(embed=recap_embed)
+    recap_status = load_recap_status(guild.id) # Relu après l'envoi pour ne pas écraser une écriture faite entre-temps
     recap_status["last_sent_week"] = current_week
-    save_recap_status(recap_status)
+    save_recap_status(guild.id, recap_status)
 
-@bot.command(name="setup")
+@tasks.loop(hours=1)
+async def weekly_recap_task():
+    await bot.wait_until_ready()
+    if get_paris_time().weekday() != 6: return # 6 = Dimanche
+    for guild in bot.guilds:
+        try: await send_weekly_recap(guild)
+        except Exception as e: print(f"Erreur récapitulatif hebdomadaire ({guild.id}): {e}")
+
+def load_absence_digest_status(guild_id: int):
+    try:
+        with open(guild_path(guild_id, ABSENCE_DIGEST_FILE), "r") as f: return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError): return {"last_sent_day": None}
+
+def save_absence_digest_status(guild_id: int, data):
+    with open(guild_path(guild_id, ABSENCE_DIGEST_FILE), "w") as f: json.dump(data, f, indent=4)
+
+async def send_absence_digest(guild: discord.Guild):
+    today = get_paris_time().date()
+    if load_absence_digest_status(guild.id).get("last_sent_day") == today.isoformat(): return
+    absence_channel = get_config_channel(guild, "absence_channel_id")
+    if not absence_channel: return
+    embed = create_absents_embed(guild, today, today, f"🗓️ Absences du jour - {today.strftime('%d/%m/%Y')}")
+    try: await absence_channel.send(embed=embed)
+    except discord.Forbidden: print(f"ERREUR: Permissions manquantes pour le récapitulatif des absences ({guild.id})."); return
+    save_absence_digest_status(guild.id, {"last_sent_day": today.isoformat()})
+
+@tasks.loop(minutes=30)
+async def absence_digest_task():
+    await bot.wait_until_ready()
+    if get_paris_time().hour < ABSENCE_DIGEST_HOUR: return
+    for guild in bot.guilds:
+        try: await send_absence_digest(guild)
+        except Exception as e: print(f"Erreur récapitulatif des absences ({guild.id}): {e}")
+
+@bot.group(name="setup", invoke_without_command=True)
 @commands.has_any_role("Patron", "Co-Patron")
 async def setup_panels(ctx):
     try: await ctx.message.delete()
     except: pass 
     msg = await ctx.send(" Mise à jour des panneaux en cours...", delete_after=10)
     panels = {
-        "annuaire": {"id": ANNUAIRE_CHANNEL_ID, "title": "📞 Annuaire Téléphonique", "coro": create_annuaire_embed, "view": AnnuaireView()},
-        "absence": {"id": ABSENCE_CHANNEL_ID, "title": "Gestion des Absences", "embed": discord.Embed(title="Gestion des Absences", description="Cliquez pour déclarer une absence.", color=discord.Color.dark_grey()), "view": AbsenceView()},
-        "annonce": {"id": ANNOUNCEMENT_CHANNEL_ID, "title": "Panneau des Annonces Internes", "embed": discord.Embed(title="Panneau des Annonces Internes", description="Cliquez pour rédiger une annonce.", color=discord.Color.dark_blue()), "view": AnnonceView()},
-        "management": {"id": MANAGEMENT_CHANNEL_ID, "title": "Panneau de Gestion des Employés", "embed": discord.Embed(title="Panneau de Gestion des Employés", description="Utilisez le bouton pour créer un dossier employé.", color=discord.Color.dark_red()), "view": OpenChannelInitView()},
-        "balances": {"id": BALANCES_SUMMARY_CHANNEL_ID, "title": "📊 Récapitulatif des Soldes", "coro": create_balances_summary_embed, "view": BalancesSummaryView()},
-        "weekly": {"id": BALANCES_SUMMARY_CHANNEL_ID, "title": "💸 Récapitulatif Hebdomadaire des Gains", "coro": create_weekly_summary_embed, "view": BalancesSummaryView()}
+        "annuaire": {"key": "annuaire_channel_id", "title": "📞 Annuaire Téléphonique", "coro": create_annuaire_embed, "view": AnnuaireView()},
+        "absence": {"key": "absence_channel_id", "title": "Gestion des Absences", "embed": discord.Embed(title="Gestion des Absences", description="Cliquez pour déclarer une absence.", color=discord.Color.dark_grey()), "view": AbsenceView()},
+        "annonce": {"key": "announcement_channel_id", "title": "Panneau des Annonces Internes", "embed": discord.Embed(title="Panneau des Annonces Internes", description="Cliquez pour rédiger une annonce.", color=discord.Color.dark_blue()), "view": AnnonceView()},
+        "management": {"key": "management_channel_id", "title": "Panneau de Gestion des Employés", "embed": discord.Embed(title="Panneau de Gestion des Employés", description="Utilisez le bouton pour créer un dossier employé.", color=discord.Color.dark_red()), "view": OpenChannelInitView()},
+        "balances": {"key": "balances_summary_channel_id", "title": "📊 Récapitulatif des Soldes", "coro": create_balances_summary_embed, "view": BalancesSummaryView()},
+        "weekly": {"key": "balances_summary_channel_id", "title": "💸 Récapitulatif Hebdomadaire des Gains", "coro": create_weekly_summary_embed, "view": BalancesSummaryView()}
     }
+    missing = []
     for name, config in panels.items():
-        channel = bot.get_channel(config["id"])
-        if not channel: print(f"WARN: Salon '{name}' introuvable."); continue
+        channel = get_config_channel(ctx.guild, config["key"])
+        if not channel: missing.append(GUILD_CONFIG_FIELDS[config["key"]][0]); continue
         embed = await config["coro"](ctx.guild) if config.get("coro") else config["embed"]
         try:
             found = False
             async for message in channel.history(limit=50):
                 if message.author == bot.user and message.embeds and message.embeds[0].title == config["title"]:
-                    await message.edit(embed=embed, view=config.get("view")); found = True; break
+                    edit_queue.submit(message, embed=embed, view=config.get("view")); found = True; break
             if not found: await channel.send(embed=embed, view=config.get("view"))
         except discord.Forbidden: print(f"ERREUR: Permissions manquantes dans '{channel.name}' pour '{name}'.")
         except Exception as e: print(f"ERREUR màj '{name}': {e}")
-    await msg.edit(content="✅ Panneaux principaux mis à jour !", delete_after=5)
+    if missing: await msg.edit(content=f"⚠️ Panneaux mis à jour, salons non configurés : {', '.join(sorted(set(missing)))} (voir `!setup config`).", delete_after=15)
+    else: await msg.edit(content="✅ Panneaux principaux mis à jour !", delete_after=5)
+
+def create_guild_config_embed(guild: discord.Guild):
+    config = get_guild_config(guild.id)
+    embed = discord.Embed(title="⚙️ Configuration du serveur", description="Modifier : `!setup config <clé> <#salon | ID | valeur>` (`aucun` pour retirer).", color=discord.Color.dark_grey())
+    for key, (alias, label) in GUILD_CONFIG_FIELDS.items():
+        value = config.get(key)
+        if value and key.endswith("_id"): value = f"<#{value}>" if guild.get_channel(value) else f"`{value}` *(introuvable)*"
+        embed.add_field(name=f"{label} (`{alias}`)", value=value or "*Non configuré*", inline=False)
+    return embed
+
+@setup_panels.command(name="config")
+@commands.has_any_role("Patron", "Co-Patron") # Le check du groupe ne s'applique pas aux sous-commandes (invoke_without_command)
+async def setup_config(ctx, cle: str = None, *, valeur: str = None):
+    if cle is None: await ctx.send(embed=create_guild_config_embed(ctx.guild)); return
+    key = next((k for k, (alias, _) in GUILD_CONFIG_FIELDS.items() if cle.lower() in (alias, k)), None)
+    if not key: await ctx.send(f"❌ Clé inconnue. Clés disponibles : {', '.join(alias for alias, _ in GUILD_CONFIG_FIELDS.values())}."); return
+    if valeur is None: await ctx.send("❌ Merci d'indiquer une valeur (ou `aucun`)."); return
+    config = dict(get_guild_config(ctx.guild.id))
+    if valeur.strip().lower() == "aucun": config[key] = None
+    elif key.endswith("_id"):
+        try: channel = ctx.guild.get_channel(int(valeur.strip().strip("<#>")))
+        except ValueError: channel = None
+        if not channel: await ctx.send("❌ Salon introuvable sur ce serveur."); return
+        if (key == "private_channel_category_id") != isinstance(channel, discord.CategoryChannel): await ctx.send("❌ Type de salon invalide pour cette clé."); return
+        config[key] = channel.id
+    else: config[key] = valeur.strip()
+    save_guild_config(ctx.guild.id, config)
+    await ctx.send(f"✅ {GUILD_CONFIG_FIELDS[key][1]} mis à jour.", embed=create_guild_config_embed(ctx.guild))
+
 @setup_panels.error
+@setup_config.error
 async def setup_panels_error(ctx, error):
     try: await ctx.message.delete()
     except: pass
@@ -806,22 +1201,713 @@ async def setup_panels_error(ctx, error):
     else: print(f"Erreur !setup: {error}"); await ctx.send(f"❌ Erreur lors du setup : {error}", delete_after=10)
 
 # =================================================================================
-# SECTION 10 : GESTION GÉNÉRALE DU BOT
+# SECTION 10 : CACHE DES MEMBRES ET DIAGNOSTICS
 # =================================================================================
+STAFF_ROLES = ["Patron", "Co-Patron", "Chef d'équipe", "Employé"]
+
+class MemberCache:
+    """Accès aux membres sans appel REST par membre.
+    En mode "full", on s'appuie sur le cache de discord.py. En mode "relevant", discord.py ne garde aucun membre :
+    on conserve seulement les porteurs des rôles du personnel et les membres ayant un dossier financier,
+    plus un LRU borné (MEMBER_LRU_SIZE) par serveur pour les autres membres récupérés à la demande."""
+    def __init__(self, mode: str, lru_size: int):
+        self.mode, self.lru_size = mode, lru_size
+        self.relevant = {} # guild_id -> {member_id: Member}
+        self.pinned = {} # guild_id -> ids ayant un dossier financier
+        self.lru = {} # guild_id -> OrderedDict(member_id -> Member)
+        self.hits, self.misses, self.rest_fetches = 0, 0, Counter()
+    def is_relevant(self, member: discord.Member):
+        if member.bot: return False
+        return member.id in self.pinned.get(member.guild.id, set()) or any(role.name in STAFF_ROLES for role in member.roles)
+    def observe(self, member: discord.Member):
+        """Met à jour le cache avec une version fraîche d'un membre (interaction, arrivée, REST)."""
+        if self.mode != "relevant": return
+        guild_id = member.guild.id
+        if self.is_relevant(member):
+            self.relevant.setdefault(guild_id, {})[member.id] = member
+            self.lru.get(guild_id, {}).pop(member.id, None)
+        else:
+            self.relevant.get(guild_id, {}).pop(member.id, None)
+            lru = self.lru.setdefault(guild_id, OrderedDict())
+            lru[member.id] = member; lru.move_to_end(member.id)
+            while len(lru) > self.lru_size: lru.popitem(last=False)
+    def forget(self, guild_id: int, member_id: int):
+        self.relevant.get(guild_id, {}).pop(member_id, None)
+        self.lru.get(guild_id, {}).pop(member_id, None)
+    def pin(self, guild_id: int, member_id: int): self.pinned.setdefault(guild_id, set()).add(member_id)
+    def get(self, guild: discord.Guild, member_id: int):
+        """Lecture sans appel réseau ; None si le membre n'est pas en cache."""
+        member = guild.get_member(member_id) if self.mode != "relevant" else self.relevant.get(guild.id, {}).get(member_id)
+        if member is None and self.mode == "relevant":
+            lru = self.lru.get(guild.id, {})
+            member = lru.get(member_id)
+            if member is not None: lru.move_to_end(member_id)
+        if member is None: self.misses += 1
+        else: self.hits += 1
+        return member
+    async def resolve(self, guild: discord.Guild, member_id: int, source: str):
+        """Comme get(), avec repli sur un appel REST (compté par appelant) en cas d'absence du cache."""
+        member = self.get(guild, member_id)
+        if member is None:
+            self.rest_fetches[source] += 1
+            member = await guild.fetch_member(member_id)
+            self.observe(member)
+        return member
+    def staff_members(self, guild: discord.Guild):
+        members = guild.members if self.mode != "relevant" else self.relevant.get(guild.id, {}).values()
+        return [m for m in members if not m.bot and any(role.name in STAFF_ROLES for role in m.roles)]
+    async def warm(self, guild: discord.Guild):
+        """Parcourt la liste des membres en flux (pages REST de 1000) et ne conserve que les membres utiles."""
+        if self.mode != "relevant": return
+        self.pinned[guild.id] = {int(member_id) for member_id in load_finances(guild.id) if member_id.isdigit()}
+        relevant = {}
+        async for member in guild.fetch_members(limit=None):
+            if self.is_relevant(member): relevant[member.id] = member
+        self.relevant[guild.id] = relevant
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {"hit_rate": self.hits / lookups if lookups else 1.0, "relevant": sum(len(m) for m in self.relevant.values()), "lru": sum(len(m) for m in self.lru.values())}
+
+member_cache = MemberCache(MEMBER_CACHE_MODE, MEMBER_LRU_SIZE)
+
+def get_process_memory_mb():
+    try:
+        with open("/proc/self/statm") as f: return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1024 / 1024
+    except (OSError, ValueError): return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+async def warm_member_cache(guild: discord.Guild):
+    try: await member_cache.warm(guild)
+    except (discord.Forbidden, discord.HTTPException) as e: print(f"Erreur chargement des membres ({guild.id}): {e}")
+
+@tasks.loop(hours=6)
+async def member_cache_refresh_task():
+    await bot.wait_until_ready()
+    for guild in bot.guilds: await warm_member_cache(guild) # Rattrape les changements de rôles des membres non mis en cache
+
+@bot.listen("on_interaction")
+async def member_cache_on_interaction(interaction: discord.Interaction):
+    if isinstance(interaction.user, discord.Member): member_cache.observe(interaction.user)
+
+@bot.listen("on_member_join")
+async def member_cache_on_join(member: discord.Member): member_cache.observe(member)
+
+def install_member_update_hook():
+    """En mode "relevant", discord.py ignore GUILD_MEMBER_UPDATE pour les membres qu'il n'a pas en cache et
+    n'émet jamais on_member_update : on traite l'événement brut pour suivre les changements de rôles en direct."""
+    state = bot._connection
+    parse_member_update = state.parsers["GUILD_MEMBER_UPDATE"]
+    def parse_member_update_with_cache(data):
+        parse_member_update(data)
+        guild = state._get_guild(int(data["guild_id"]))
+        if guild is None: return
+        try: member_cache.observe(discord.Member(data={"flags": 0, **data}, guild=guild, state=state))
+        except (KeyError, ValueError, TypeError) as e: print(f"Erreur GUILD_MEMBER_UPDATE ({data.get('guild_id')}): {e}")
+    state.parsers["GUILD_MEMBER_UPDATE"] = parse_member_update_with_cache
+if member_cache.mode == "relevant": install_member_update_hook()
+
+@bot.listen("on_raw_member_remove")
+async def member_cache_on_remove(payload: discord.RawMemberRemoveEvent): member_cache.forget(payload.guild_id, payload.user.id)
+
+@bot.listen("on_guild_join")
+async def member_cache_on_guild_join(guild: discord.Guild): await warm_member_cache(guild)
+
+def create_diagnostics_embed(guild: discord.Guild):
+    stats = member_cache.stats()
+    embed = discord.Embed(title="🩺 Diagnostics", color=discord.Color.dark_grey())
+    embed.add_field(name="Mémoire", value=f"RSS : **{get_process_memory_mb():.1f} Mo**\nPic : {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.1f} Mo", inline=True)
+    embed.add_field(name="Serveurs", value=f"{len(bot.guilds)} serveur(s) - {bot.shard_count or 1} shard(s)", inline=True)
+    cache_text = (f"Mode : `{member_cache.mode}`\n"
+                  f"Membres discord.py : **{sum(len(g.members) for g in bot.guilds)}**\n"
+                  f"Membres utiles : **{stats['relevant']}** - LRU : **{stats['lru']}** / {member_cache.lru_size} par serveur\n"
+                  f"Ce serveur : {len(member_cache.relevant.get(guild.id, {})) if member_cache.mode == 'relevant' else guild.member_count} membre(s) suivis\n"
+                  f"Taux de succès : **{stats['hit_rate']:.1%}** ({member_cache.hits} / {member_cache.hits + member_cache.misses})")
+    embed.add_field(name="Cache des membres", value=cache_text, inline=False)
+    rest_text = "\n".join(f"`{source}` : {count}" for source, count in member_cache.rest_fetches.most_common()) or "Aucun"
+    embed.add_field(name="Appels REST de repli (fetch_member)", value=rest_text, inline=False)
+    queue = edit_queue.stats()
+    queue_text = (f"En attente : **{queue['pending']}** (envoi en cours : {queue['in_flight']})\n"
+                  f"Envoyées : {queue['sent']} - Fusionnées : {queue['merged']} - Nouvelles tentatives : {queue['retries']}\n"
+                  f"Échecs : **{queue['failed']}**")
+    if edit_queue.failures: queue_text += "\n" + "\n".join(f"`{reason}` : {count}" for reason, count in edit_queue.failures.most_common(5))
+    embed.add_field(name="File d'édition des panneaux", value=queue_text, inline=False)
+    embed.set_footer(text=f"Généré le {format_paris_time(get_paris_time())}")
+    return embed
+
+@bot.command(name="diagnostics")
+@commands.has_any_role("Patron")
+async def diagnostics(ctx): await ctx.send(embed=create_diagnostics_embed(ctx.guild))
+@diagnostics.error
+async def diagnostics_error(ctx, error):
+    if isinstance(error, commands.MissingAnyRole): await ctx.send("❌ Vous n'avez pas la permission.", delete_after=10)
+    else: print(f"Erreur !diagnostics: {error}")
+
+# =================================================================================
+# SECTION 11 : JOURNAL D'AUDIT LOCAL (!AUDIT)
+# =================================================================================
+# Chaque modification envoyée dans les salons de logs est aussi écrite dans une base SQLite par serveur,
+# indexée par auteur, cible, élément et date pour pouvoir être recherchée sans parcourir Discord.
+AUDIT_PAGE_SIZE = 10
+_audit_connections = {}
+def get_audit_db(guild_id: int):
+    if guild_id not in _audit_connections:
+        conn = sqlite3.connect(guild_path(guild_id, AUDIT_DB_FILE))
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL"); conn.execute("PRAGMA synchronous=NORMAL")
+        conn.executescript("""
+            CREATE TABLE IF NOT EXISTS audit_events (
+                id INTEGER PRIMARY KEY AUTOINCREMENT, ts INTEGER NOT NULL, kind TEXT NOT NULL, action TEXT NOT NULL,
+                author_id INTEGER NOT NULL, target_id INTEGER, item TEXT, item_key TEXT,
+                old_value TEXT, new_value TEXT, amount TEXT, details TEXT);
+            CREATE INDEX IF NOT EXISTS idx_audit_author ON audit_events (author_id, ts);
+            CREATE INDEX IF NOT EXISTS idx_audit_target ON audit_events (target_id, ts);
+            CREATE INDEX IF NOT EXISTS idx_audit_item ON audit_events (item_key, ts);
+            CREATE INDEX IF NOT EXISTS idx_audit_kind ON audit_events (kind, ts);
+            CREATE INDEX IF NOT EXISTS idx_audit_ts ON audit_events (ts);
+        """)
+        _audit_connections[guild_id] = conn
+    return _audit_connections[guild_id]
+
+def audit_item_key(item: str):
+    """Clé de recherche d'un élément : "Total - sp98" -> "sp98", "Paiement" -> "paiement"."""
+    return item.rsplit(" - ", 1)[-1].strip().lower().replace(" ", "_")
+
+def record_stock_audit(guild_id: int, author_id: int, changes: list, action_type: str):
+    ts = int(get_paris_time().timestamp())
+    rows = [(ts, "stock", action_type, author_id, None, change.get("item", "Action"), audit_item_key(change.get("item", "Action")), change.get("old"), change.get("new"), None, None) for change in changes]
+    try:
+        with get_audit_db(guild_id) as conn: conn.executemany("INSERT INTO audit_events (ts, kind, action, author_id, target_id, item, item_key, old_value, new_value, amount, details) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+    except sqlite3.Error as e: print(f"ERREUR: Écriture du journal d'audit impossible ({guild_id}): {e}")
+
+def record_finance_audit(guild_id: int, author_id: int, member_id: int, action_type: str, amount: str, details: str):
+    row = (int(get_paris_time().timestamp()), "finance", action_type, author_id, member_id, action_type, audit_item_key(action_type), None, None, amount, details)
+    try:
+        with get_audit_db(guild_id) as conn: conn.execute("INSERT INTO audit_events (ts, kind, action, author_id, target_id, item, item_key, old_value, new_value, amount, details) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", row)
+    except sqlite3.Error as e: print(f"ERREUR: Écriture du journal d'audit impossible ({guild_id}): {e}")
+
+def paris_day_bounds(day):
+    paris_tz = pytz.timezone("Europe/Paris")
+    start = paris_tz.localize(datetime.combine(day, dt_time.min))
+    end = paris_tz.localize(datetime.combine(day + timedelta(days=1), dt_time.min))
+    return int(start.timestamp()), int(end.timestamp())
+
+def _audit_where(filters: dict):
+    clauses, params = [], []
+    for column in ("author_id", "target_id", "item_key", "kind"):
+        if filters.get(column) is not None: clauses.append(f"{column} = ?"); params.append(filters[column])
+    if filters.get("ts_from") is not None: clauses.append("ts >= ?"); params.append(filters["ts_from"])
+    if filters.get("ts_to") is not None: clauses.append("ts < ?"); params.append(filters["ts_to"])
+    return " AND ".join(clauses) or "1 = 1", params
+
+def count_audit_events(guild_id: int, filters: dict):
+    """Nombre total de résultats : calculé une seule fois par recherche, pas à chaque page."""
+    where, params = _audit_where(filters)
+    return get_audit_db(guild_id).execute(f"SELECT COUNT(*) FROM audit_events WHERE {where}", params).fetchone()[0]
+
+def query_audit_events(guild_id: int, filters: dict, before: tuple = None, limit: int = AUDIT_PAGE_SIZE):
+    """Page d'événements (du plus récent au plus ancien). La pagination repart du dernier (ts, id) affiché plutôt que d'un OFFSET,
+    ce qui permet aux index (colonne, ts) de servir à la fois le filtre et le tri, quelle que soit la page."""
+    where, params = _audit_where(filters)
+    page_clause = " AND (ts, id) < (?, ?)" if before is not None else ""
+    return get_audit_db(guild_id).execute(f"SELECT * FROM audit_events WHERE {where}{page_clause} ORDER BY ts DESC, id DESC LIMIT ?", params + (list(before) if before is not None else []) + [limit]).fetchall()
+
+def format_audit_event(row):
+    when = discord.utils.format_dt(datetime.fromtimestamp(row["ts"], pytz.timezone("Europe/Paris")), style="f")
+    if row["kind"] == "stock":
+        return f"{when} · <@{row['author_id']}>\n📦 **{row['item'].replace('_', ' ')}** : `{row['old_value'] or 'N/A'}` → `{row['new_value'] or 'N/A'}` *({row['action']})*"
+    details = f" ({row['details']})" if row["details"] else ""
+    return f"{when} · <@{row['author_id']}>\n💸 **{row['action']}** pour <@{row['target_id']}> : `{row['amount']}`{details}"
+
+class AuditPageView(View):
+    def __init__(self, guild_id: int, filters: dict, author_id: int):
+        super().__init__(timeout=300)
+        self.guild_id, self.filters, self.author_id = guild_id, filters, author_id
+        self.total = count_audit_events(guild_id, filters)
+        self.cursors = [None] # Curseur (ts, id) de chaque page déjà affichée
+        self.next_cursor = None
+    async def interaction_check(self, interaction: discord.Interaction):
+        if interaction.user.id == self.author_id: return True
+        await interaction.response.send_message("❌ Seul l'auteur de la recherche peut changer de page.", ephemeral=True); return False
+    def build_page(self):
+        rows, total = query_audit_events(self.guild_id, self.filters, self.cursors[-1]), self.total
+        self.next_cursor = (rows[-1]["ts"], rows[-1]["id"]) if len(rows) == AUDIT_PAGE_SIZE else None
+        self.previous_button.disabled = len(self.cursors) == 1
+        self.next_button.disabled = self.next_cursor is None
+        embed = discord.Embed(title="🔎 Journal d'audit", color=discord.Color.blue())
+        embed.description = "\n\n".join(format_audit_event(row) for row in rows) if rows else "Aucun événement ne correspond à ces critères."
+        pages = max(1, -(-total // AUDIT_PAGE_SIZE))
+        embed.set_footer(text=f"Page {len(self.cursors)}/{pages} - {total} événement(s)")
+        return embed
+    @discord.ui.button(label="◀", style=discord.ButtonStyle.secondary)
+    @profiled
+    async def previous_button(self, i: discord.Interaction, b: Button):
+        if len(self.cursors) > 1: self.cursors.pop()
+        await i.response.edit_message(embed=self.build_page(), view=self)
+    @discord.ui.button(label="▶", style=discord.ButtonStyle.secondary)
+    @profiled
+    async def next_button(self, i: discord.Interaction, b: Button):
+        if self.next_cursor is not None: self.cursors.append(self.next_cursor)
+        await i.response.edit_message(embed=self.build_page(), view=self)
+
+@bot.hybrid_command(name="audit", description="Recherche dans l'historique des modifications de stock et de finances.")
+@commands.has_any_role("Patron", "Co-Patron")
+async def audit(ctx, auteur: discord.Member = None, cible: discord.Member = None, element: str = None, depuis: str = None, jusqua: str = None, categorie: str = None):
+    filters = {"author_id": auteur.id if auteur else None, "target_id": cible.id if cible else None, "item_key": audit_item_key(element) if element else None}
+    if categorie:
+        if categorie.lower() not in ("stock", "finance"): await ctx.send("⚠️ La catégorie doit être `stock` ou `finance`.", ephemeral=True); return
+        filters["kind"] = categorie.lower()
+    for name, value in (("depuis", depuis), ("jusqua", jusqua)):
+        if not value: continue
+        day = parse_absence_date(value)
+        if not day: await ctx.send("⚠️ Les dates doivent être au format JJ/MM/AAAA (ex: 10/10/2025).", ephemeral=True); return
+        day_start, day_end = paris_day_bounds(day)
+        if name == "depuis": filters["ts_from"] = day_start
+        else: filters["ts_to"] = day_end
+    view = AuditPageView(ctx.guild.id, filters, ctx.author.id)
+    await ctx.send(embed=view.build_page(), view=view, ephemeral=True)
+@audit.error
+async def audit_error(ctx, error):
+    if isinstance(error, commands.MissingAnyRole): await ctx.send("❌ Vous n'avez pas la permission.", ephemeral=True)
+    elif isinstance(error, commands.BadArgument): await ctx.send("⚠️ Membre introuvable.", ephemeral=True)
+    else: print(f"Erreur !audit: {error}"); await ctx.send("❌ Une erreur est survenue lors de la recherche.", ephemeral=True)
+
+# =================================================================================
+# SECTION 12 : PROFILAGE (!PROFILE)
+# =================================================================================
+def create_profile_report_embed(result: dict):
+    embed = discord.Embed(title=f"⏱️ Profil de {result['name']}", description=f"Durée : **{result['elapsed'] * 1000:.1f} ms** - {result['at']}", color=discord.Color.dark_grey())
+    table = "\n".join(result["table"])
+    if len(table) > 1000: table = table[:1000] + "\n…"
+    embed.add_field(name=f"Top {PROFILE_TOP_N} (temps cumulé)", value=f"```\n{table}\n```", inline=False)
+    if result["memory"]:
+        memory = "\n".join(result["memory"])
+        if len(memory) > 1000: memory = memory[:1000] + "\n…"
+        embed.add_field(name="Allocations (tracemalloc)", value=f"```\n{memory}\n```", inline=False)
+    embed.set_footer(text=f"Profil complet : {result['path']}")
+    return embed
+
+@bot.hybrid_command(name="profile", description="Profile les prochains appels d'un handler (on / off / statut / rapport).")
+@commands.is_owner() # Les requêtes et les fichiers de profil sont communs à tous les serveurs
+async def profile(ctx, action: str, handler: str = "all", n: Optional[int] = 1, memoire: str = None):
+    action, n = action.lower(), n or 1
+    memoire = memoire is not None and memoire.lower() in ("memoire", "mémoire", "oui", "true") # "!profile on all 5 memoire"
+    if action == "on":
+        name = "all" if handler.lower() == "all" else next((h for h in PROFILABLE_HANDLERS if h.lower() == handler.lower()), None)
+        if name is None: await ctx.send(f"❌ Handler inconnu. Disponibles : {', '.join(sorted(PROFILABLE_HANDLERS))}", ephemeral=True); return
+        if not 1 <= n <= 100: await ctx.send("⚠️ Le nombre d'appels doit être compris entre 1 et 100.", ephemeral=True); return
+        _profile_requests[name] = {"remaining": n, "memory": memoire}
+        await ctx.send(f"✅ Profilage activé pour **{name}** ({n} appel(s){', avec suivi mémoire' if memoire else ''}).", ephemeral=True)
+    elif action == "off":
+        _profile_requests.clear()
+        await ctx.send("✅ Profilage désactivé.", ephemeral=True)
+    elif action == "statut":
+        pending = "\n".join(f"• **{name}** : {request['remaining']} appel(s) restant(s){' (mémoire)' if request['memory'] else ''}" for name, request in _profile_requests.items()) or "Aucun profilage en attente."
+        done = "\n".join(f"• {result['at']} - {result['name']} ({result['elapsed'] * 1000:.1f} ms)" for result in _profile_results[:10]) or "Aucun profil enregistré."
+        embed = discord.Embed(title="⏱️ Profilage", color=discord.Color.dark_grey())
+        embed.add_field(name="En attente", value=pending, inline=False); embed.add_field(name="Derniers profils", value=done, inline=False)
+        await ctx.send(embed=embed, ephemeral=True)
+    elif action == "rapport":
+        result = next((r for r in _profile_results if handler.lower() in ("all", r["name"].lower())), None)
+        if not result: await ctx.send("ℹ️ Aucun profil disponible pour l'instant.", ephemeral=True); return
+        await ctx.send(embed=create_profile_report_embed(result), ephemeral=True)
+    else: await ctx.send("⚠️ Action inconnue : `on`, `off`, `statut` ou `rapport`.", ephemeral=True)
+@profile.error
+async def profile_error(ctx, error):
+    if isinstance(error, commands.NotOwner): await ctx.send("❌ Réservé au propriétaire du bot.", ephemeral=True)
+    elif isinstance(error, (commands.BadArgument, commands.MissingRequiredArgument)): await ctx.send("⚠️ Utilisation : `!profile on <handler|all> [n] [memoire]`, `!profile off`, `!profile statut`, `!profile rapport [handler]`.", ephemeral=True)
+    else: print(f"Erreur !profile: {error}")
+
+# =================================================================================
+# SECTION 13 : REGISTRE DES MOUVEMENTS DE STOCK (!RECONCILIATION)
+# =================================================================================
+# Chaque quantité (entrepôt, stock total, carburant d'une pompe) est un compartiment :
+#   "entrepot/petrole_non_raffine", "total/sp98", "pompe/stations/Station de Lampaul/Pompe 1/sp98".
+# Un mouvement débite un compartiment et en crédite un autre ("externe" pour ce qui entre ou sort de l'entreprise).
+# stocks.json et locations.json restent la référence des panneaux ; le registre garde les soldes attendus,
+# mis à jour à chaque transaction, pour détecter les écarts.
+EXTERNAL_BUCKET = "externe"
+LEDGER_MAX_TRANSACTIONS = 1000 # L'historique complet reste dans le journal d'audit
+REFINED_FUELS = ["gazole", "sp95", "sp98", "kerosene"]
+STOCK_MOVEMENT_TYPES = {
+    "livraison": "Livraison de pétrole (externe → entrepôt)",
+    "transfert": "Sortie d'entrepôt (entrepôt → total)",
+    "raffinage": "Raffinage (pétrole → carburant)",
+    "remplissage": "Remplissage d'une pompe (total → pompe)",
+    "ajustement": "Correction manuelle",
+    "regularisation": "Régularisation du registre",
+}
+
+def iter_stock_buckets(stocks: dict, locations: dict):
+    for category in ("entrepot", "total"):
+        for item, qty in stocks.get(category, {}).items(): yield f"{category}/{item}", qty
+    for cat_key, cat_locations in locations.items():
+        for loc_name, loc_data in cat_locations.items():
+            for pump_name, fuels in loc_data.get("pumps", {}).items():
+                for fuel, qty in fuels.items(): yield f"pompe/{cat_key}/{loc_name}/{pump_name}/{fuel}", qty
+
+def _bucket_ref(stocks: dict, locations: dict, bucket: str):
+    """(dictionnaire, clé) contenant la quantité d'un compartiment, ou (None, None) s'il n'existe pas."""
+    parts = bucket.split("/")
+    if len(parts) == 2 and parts[1] in stocks.get(parts[0], {}): return stocks[parts[0]], parts[1]
+    if len(parts) == 5 and parts[0] == "pompe":
+        fuels = locations.get(parts[1], {}).get(parts[2], {}).get("pumps", {}).get(parts[3], {})
+        if parts[4] in fuels: return fuels, parts[4]
+    return None, None
+
+def stock_bucket_label(bucket: str):
+    parts = bucket.split("/")
+    if parts[0] == "pompe": return f"{parts[2]} / {parts[3]} - {parts[4]}"
+    return f"{parts[0].title()} - {parts[1]}"
+
+def _ledger_add(ledger: dict, bucket: str, delta: int):
+    ledger["balances"][bucket] = ledger["balances"].get(bucket, 0) + delta
+    if bucket.startswith("pompe/"):
+        total_key = f"pompes/{bucket.rsplit('/', 1)[-1]}"
+        ledger["totals"][total_key] = ledger["totals"].get(total_key, 0) + delta
+
+def load_stock_ledger(guild_id: int):
+    try:
+        with open(guild_path(guild_id, STOCK_LEDGER_FILE), "r", encoding="utf-8") as f: return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        ledger = {"balances": {}, "totals": {}, "transactions": [], "next_id": 1} # Ouverture du registre à partir des quantités actuelles
+        for bucket, qty in iter_stock_buckets(load_stocks(guild_id), load_locations(guild_id)): _ledger_add(ledger, bucket, qty)
+        save_stock_ledger(guild_id, ledger); return ledger
+
+def save_stock_ledger(guild_id: int, data):
+    with open(guild_path(guild_id, STOCK_LEDGER_FILE), "w", encoding="utf-8") as f: json.dump(data, f, indent=4, ensure_ascii=False)
+
+def _append_ledger_transaction(ledger: dict, kind: str, movements: list, author_id: int, ts: int):
+    for debit, credit, quantity in movements:
+        if debit != EXTERNAL_BUCKET: _ledger_add(ledger, debit, -quantity)
+        if credit != EXTERNAL_BUCKET: _ledger_add(ledger, credit, quantity)
+    ledger["transactions"].append({"id": ledger["next_id"], "ts": ts, "kind": kind, "author_id": author_id, "movements": [list(m) for m in movements]})
+    ledger["next_id"] += 1
+    del ledger["transactions"][:-LEDGER_MAX_TRANSACTIONS]
+
+def commit_stock_transaction(guild_id: int, kind: str, movements: list, author_id: int, touched=()):
+    """Applique des mouvements (débit, crédit, quantité) aux stocks, aux pompes et au registre en une seule transaction.
+    Rien n'est écrit si un mouvement est invalide. Retourne (erreur, changements pour les logs)."""
+    stocks, locations, ledger = load_stocks(guild_id), load_locations(guild_id), load_stock_ledger(guild_id)
+    before = {}
+    for debit, credit, quantity in movements:
+        if quantity <= 0: return "La quantité doit être strictement positive.", []
+        for bucket, sign in ((debit, -1), (credit, 1)):
+            if bucket == EXTERNAL_BUCKET: continue
+            container, key = _bucket_ref(stocks, locations, bucket)
+            if container is None: return f"Compartiment inconnu : {bucket}", []
+            before.setdefault(bucket, container[key])
+            new_value = container[key] + sign * quantity
+            if new_value < 0: return f"Stock insuffisant pour {stock_bucket_label(bucket)} ({container[key]:,} disponibles).".replace(',', ' '), []
+            capacity = PUMP_MAX_CAPACITY.get(key) if bucket.startswith("pompe/") else None
+            if kind == "remplissage" and capacity and new_value > capacity: return f"Capacité dépassée pour {stock_bucket_label(bucket)} ({capacity:,} L max, {container[key]:,} L actuellement).".replace(',', ' '), []
+            container[key] = new_value
+    now = get_paris_time()
+    touched_locations = {tuple(bucket.split("/")[1:3]) for bucket in list(before) + list(touched) if bucket.startswith("pompe/")}
+    for cat_key, loc_name in touched_locations: locations[cat_key][loc_name]["last_updated"] = format_paris_time(now)
+    if any(not bucket.startswith("pompe/") for bucket in before): save_stocks(guild_id, stocks)
+    if touched_locations: save_locations(guild_id, locations)
+    if movements:
+        _append_ledger_transaction(ledger, kind, movements, author_id, int(now.timestamp()))
+        save_stock_ledger(guild_id, ledger)
+    changes = []
+    for bucket, old_value in before.items():
+        container, key = _bucket_ref(stocks, locations, bucket)
+        changes.append({"item": stock_bucket_label(bucket), "old": f"{old_value:,}".replace(',', ' '), "new": f"{container[key]:,}".replace(',', ' ')})
+    return None, changes
+
+def commit_stock_adjustments(guild_id: int, targets: dict, author_id: int):
+    """Fixe des compartiments à une valeur donnée (saisie manuelle) : l'écart est enregistré comme une correction."""
+    stocks, locations = load_stocks(guild_id), load_locations(guild_id)
+    movements = []
+    for bucket, new_value in targets.items():
+        container, key = _bucket_ref(stocks, locations, bucket)
+        if container is None: return f"Compartiment inconnu : {bucket}", []
+        if new_value < 0: return f"La quantité pour {stock_bucket_label(bucket)} ne peut pas être négative.", []
+        delta = new_value - container[key]
+        if delta > 0: movements.append((EXTERNAL_BUCKET, bucket, delta))
+        elif delta < 0: movements.append((bucket, EXTERNAL_BUCKET, -delta))
+    return commit_stock_transaction(guild_id, "ajustement", movements, author_id, touched=targets.keys())
+
+def build_stock_movement(guild_id: int, kind: str, fuel: str, quantity: int, destination: str):
+    """Traduit la saisie du formulaire en mouvement (débit, crédit, quantité). Retourne (mouvement, erreur)."""
+    if kind == "livraison": return (EXTERNAL_BUCKET, "entrepot/petrole_non_raffine", quantity), None
+    if kind == "transfert": return ("entrepot/petrole_non_raffine", "total/petrole_non_raffine", quantity), None
+    if fuel not in REFINED_FUELS: return None, f"Le carburant doit être : {', '.join(REFINED_FUELS)}."
+    if kind == "raffinage": return ("total/petrole_non_raffine", f"total/{fuel}", quantity), None
+    if kind != "remplissage": return None, f"Type inconnu. Types disponibles : {', '.join(k for k in STOCK_MOVEMENT_TYPES if k not in ('ajustement', 'regularisation'))}."
+    loc_query, _, pump_query = (part.strip().lower() for part in destination.partition("/"))
+    for cat_key, cat_locations in load_locations(guild_id).items():
+        for loc_name, loc_data in cat_locations.items():
+            if loc_name.lower() != loc_query: continue
+            pumps = [name for name, fuels in loc_data.get("pumps", {}).items() if fuel in fuels]
+            pump_name = next((name for name in pumps if name.lower() == pump_query), None) if pump_query else (pumps[0] if len(pumps) == 1 else None)
+            if not pump_name: return None, f"Précise la pompe ({', '.join(pumps) or 'aucune pompe pour ce carburant'}), ex: `{loc_name} / {pumps[0] if pumps else 'Pompe 1'}`."
+            return (f"total/{fuel}", f"pompe/{cat_key}/{loc_name}/{pump_name}/{fuel}", quantity), None
+    return None, "Lieu introuvable. Format attendu : `Station de Lampaul / Pompe 1`."
+
+def load_stock_panels(guild_id: int):
+    try:
+        with open(guild_path(guild_id, STOCK_PANELS_FILE), "r", encoding="utf-8") as f: return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError): return {"stocks": [], "stations": []}
+
+def save_stock_panels(guild_id: int, data):
+    with open(guild_path(guild_id, STOCK_PANELS_FILE), "w", encoding="utf-8") as f: json.dump(data, f, indent=4)
+
+def register_stock_panel(guild_id: int, kind: str, channel_id: int, message_id: int):
+    panels = load_stock_panels(guild_id)
+    if [channel_id, message_id] not in panels.setdefault(kind, []):
+        panels[kind].append([channel_id, message_id]); save_stock_panels(guild_id, panels)
+
+def unregister_stock_panel(guild_id: int, kind: str, channel_id: int, message_id: int):
+    panels = load_stock_panels(guild_id)
+    if [channel_id, message_id] in panels.get(kind, []):
+        panels[kind].remove([channel_id, message_id]); save_stock_panels(guild_id, panels)
+
+async def refresh_stock_panels(guild: discord.Guild):
+    """Actualise tous les panneaux !stocks et !stations du serveur à partir des mêmes données (via la file d'édition)."""
+    panels = load_stock_panels(guild.id)
+    contents = {"stocks": {"embed": create_stocks_embed(guild.id), "view": StockView()}, "stations": {"embeds": create_locations_embeds(guild.id), "view": LocationsView()}}
+    for kind, content in contents.items():
+        for channel_id, message_id in list(panels.get(kind, [])):
+            channel = guild.get_channel(channel_id)
+            if not channel: unregister_stock_panel(guild.id, kind, channel_id, message_id); continue
+            edit_queue.submit(channel.get_partial_message(message_id), stock_panel=(guild.id, kind), **content)
+
+async def apply_stock_commit(interaction: discord.Interaction, result: tuple, action_type: str, panel_kind: str, original_message_id: int, success_message: str):
+    """Suite commune après une transaction : log, actualisation des deux panneaux et réponse à l'utilisateur."""
+    error, changes = result
+    if error: await interaction.followup.send(f"⚠️ {error}", ephemeral=True); return
+    if changes: await log_stock_change(interaction, changes, action_type)
+    if original_message_id: register_stock_panel(interaction.guild_id, panel_kind, interaction.channel_id, original_message_id)
+    await refresh_stock_panels(interaction.guild)
+    await interaction.followup.send(success_message, ephemeral=True)
+
+class StockMovementModal(Modal, title="Enregistrer un mouvement de stock"):
+    type_mouvement = TextInput(label="Type : livraison, transfert, raffinage, remplissage", placeholder="Ex: remplissage", max_length=20)
+    carburant = TextInput(label="Carburant (raffinage / remplissage)", placeholder="gazole, sp95, sp98 ou kerosene", required=False, max_length=20)
+    quantite = TextInput(label="Quantité (L)", placeholder="Ex: 1500", max_length=9)
+    destination = TextInput(label="Pompe à remplir (remplissage)", placeholder="Ex: Station de Lampaul / Pompe 1", required=False)
+    def __init__(self, original_message_id: int, panel_kind: str):
+        super().__init__(); self.original_message_id, self.panel_kind = original_message_id, panel_kind
+    @profiled
+    async def on_submit(self, interaction: discord.Interaction):
+        await interaction.response.defer(ephemeral=True)
+        kind = self.type_mouvement.value.strip().lower()
+        fuel = self.carburant.value.strip().lower().replace("é", "e").replace("è", "e")
+        try: quantity = int(self.quantite.value)
+        except ValueError: await interaction.followup.send("⚠️ La quantité doit être un nombre.", ephemeral=True); return
+        movement, error = build_stock_movement(interaction.guild_id, kind, fuel, quantity, self.destination.value)
+        if error: await interaction.followup.send(f"⚠️ {error}", ephemeral=True); return
+        result = commit_stock_transaction(interaction.guild_id, kind, [movement], interaction.user.id)
+        await apply_stock_commit(interaction, result, STOCK_MOVEMENT_TYPES[kind], self.panel_kind, self.original_message_id, f"✅ {STOCK_MOVEMENT_TYPES[kind]} : **{quantity:,} L** enregistrés.".replace(',', ' '))
+
+def reconcile_stocks(guild_id: int):
+    """Compare les soldes du registre aux quantités réelles. Retourne (registre, {compartiment: (attendu, réel)})."""
+    ledger = load_stock_ledger(guild_id)
+    actual = dict(iter_stock_buckets(load_stocks(guild_id), load_locations(guild_id)))
+    discrepancies = {}
+    for bucket in set(actual) | set(ledger["balances"]):
+        expected, real = ledger["balances"].get(bucket, 0), actual.get(bucket, 0)
+        if expected != real: discrepancies[bucket] = (expected, real)
+    return ledger, discrepancies
+
+def regularize_stock_ledger(guild_id: int, author_id: int):
+    """Aligne le registre sur les quantités réelles (sans toucher aux stocks) et trace l'écart comme régularisation."""
+    ledger, discrepancies = reconcile_stocks(guild_id)
+    movements = [(EXTERNAL_BUCKET, bucket, real - expected) if real > expected else (bucket, EXTERNAL_BUCKET, expected - real) for bucket, (expected, real) in discrepancies.items()]
+    if movements:
+        _append_ledger_transaction(ledger, "regularisation", movements, author_id, int(get_paris_time().timestamp()))
+        save_stock_ledger(guild_id, ledger)
+    return len(movements)
+
+def create_reconciliation_embed(guild_id: int, days: int = 7):
+    ledger, discrepancies = reconcile_stocks(guild_id)
+    embed = discord.Embed(title="📒 Réconciliation des stocks", color=discord.Color.red() if discrepancies else discord.Color.green())
+    if discrepancies:
+        lines = [f"• {stock_bucket_label(bucket)} : registre `{expected:,}` / réel `{real:,}` → **{real - expected:+,}**".replace(',', ' ') for bucket, (expected, real) in sorted(discrepancies.items())]
+        if len(lines) > 20: lines = lines[:20] + [f"… et {len(discrepancies) - 20} autre(s)"]
+        embed.description = "⚠️ Écarts entre le registre et les quantités saisies :\n" + "\n".join(lines) + "\n\n`!reconciliation corriger` aligne le registre sur les quantités réelles."
+    else: embed.description = "✅ Le registre correspond aux stocks et aux pompes."
+    since = int(get_paris_time().timestamp()) - days * 86400
+    flows = {}
+    for transaction in ledger["transactions"]:
+        if transaction["ts"] < since: continue
+        for debit, credit, quantity in transaction["movements"]:
+            fuel = (credit if credit != EXTERNAL_BUCKET else debit).rsplit("/", 1)[-1]
+            flows.setdefault(transaction["kind"], {}).setdefault(fuel, 0)
+            flows[transaction["kind"]][fuel] += quantity
+    for kind, per_fuel in flows.items():
+        embed.add_field(name=f"{STOCK_MOVEMENT_TYPES.get(kind, kind)} ({days} j)", value=" | ".join(f"{fuel}: **{qty:,}**".replace(',', ' ') for fuel, qty in per_fuel.items()), inline=False)
+    pump_totals = " | ".join(f"{fuel}: **{ledger['totals'].get(f'pompes/{fuel}', 0):,}**".replace(',', ' ') for fuel in REFINED_FUELS)
+    embed.add_field(name="⛽ Carburant en pompes (registre)", value=pump_totals, inline=False)
+    embed.set_footer(text=f"{len(ledger['transactions'])} transaction(s) en mémoire - {format_paris_time(get_paris_time())}")
+    return embed
+
+@bot.command(name="reconciliation")
+@commands.has_any_role("Patron", "Co-Patron")
+async def reconciliation(ctx, action: str = None):
+    if action and action.lower() == "corriger":
+        count = regularize_stock_ledger(ctx.guild.id, ctx.author.id)
+        await ctx.send(f"✅ {count} écart(s) régularisé(s) dans le registre." if count else "ℹ️ Aucun écart à régulariser.")
+    await ctx.send(embed=create_reconciliation_embed(ctx.guild.id))
+@reconciliation.error
+async def reconciliation_error(ctx, error):
+    if isinstance(error, commands.MissingAnyRole): await ctx.send("❌ Vous n'avez pas la permission.", delete_after=10)
+    else: print(f"Erreur !reconciliation: {error}"); await ctx.send("❌ Une erreur est survenue lors de la réconciliation.")
+
+# =================================================================================
+# SECTION 14 : FILE D'ÉDITION DES PANNEAUX
+# =================================================================================
+# Les éditions de panneaux ne sont plus attendues dans les interactions : elles passent par une file qui
+# ne garde que le contenu le plus récent par message, réessaie les erreurs 5xx / délais dépassés avec une
+# attente aléatoire croissante, et est sauvegardée sur disque pour être reprise après un redémarrage.
+EDIT_MAX_ATTEMPTS = 6
+EDIT_BACKOFF_BASE, EDIT_BACKOFF_MAX = 1.0, 60.0 # secondes
+EDIT_TIMEOUT = 15.0
+EDIT_QUEUE_SAVE_DELAY = 1.0 # Regroupe les écritures du fichier de la file
+RETRYABLE_EDIT_ERRORS = (discord.DiscordServerError, asyncio.TimeoutError, aiohttp.ClientError, OSError)
+
+class PanelEditQueue:
+    """Une édition en attente par message (channel_id, message_id) et une tâche d'envoi par message au plus."""
+    def __init__(self, path: str):
+        self.path = path
+        self.pending = {} # (channel_id, message_id) -> {"message", "embeds", "view", "stock_panel"}
+        self.workers = {}
+        self.sent, self.retries, self.merged, self.restored, self.save_scheduled = 0, 0, 0, False, False
+        self.failures = Counter()
+
+    def submit(self, message, embed: discord.Embed = None, embeds: list = None, view: View = None, stock_panel: tuple = None):
+        """Programme l'édition d'un message. Une édition encore en attente pour ce message est remplacée.
+        stock_panel=(guild_id, kind) désenregistre le panneau de stock si le message a été supprimé."""
+        key = (message.channel.id, message.id)
+        if key in self.pending: self.merged += 1
+        self.pending[key] = {"message": message, "embeds": [embed] if embed is not None else embeds, "view": view, "stock_panel": stock_panel}
+        self.schedule_save()
+        if key not in self.workers: self.workers[key] = asyncio.create_task(self._deliver(key))
+
+    async def _deliver(self, key: tuple):
+        attempt = 0
+        try:
+            while key in self.pending:
+                entry = self.pending[key]
+                kwargs = {"embeds": entry["embeds"]}
+                if entry["view"] is not None: kwargs["view"] = entry["view"]
+                try: await asyncio.wait_for(entry["message"].edit(**kwargs), EDIT_TIMEOUT)
+                except (discord.NotFound, discord.Forbidden) as e:
+                    self._fail(key, entry, type(e).__name__, force=True)
+                    if entry["stock_panel"] and isinstance(e, discord.NotFound): unregister_stock_panel(*entry["stock_panel"], *key)
+                except RETRYABLE_EDIT_ERRORS as e:
+                    attempt += 1
+                    if attempt >= EDIT_MAX_ATTEMPTS: self._fail(key, entry, f"{type(e).__name__} ({attempt} tentatives)"); attempt = 0; continue
+                    self.retries += 1
+                    await asyncio.sleep(random.uniform(0, min(EDIT_BACKOFF_MAX, EDIT_BACKOFF_BASE * 2 ** attempt))) # Un contenu plus récent a pu arriver entre-temps
+                except discord.HTTPException as e: self._fail(key, entry, f"HTTP {e.status}"); attempt = 0
+                except Exception as e: self._fail(key, entry, type(e).__name__); attempt = 0 # Ex : View invalide ; sans ça l'entrée resterait bloquée
+                else:
+                    self.sent += 1; attempt = 0
+                    if self.pending.get(key) is entry: del self.pending[key]; self.schedule_save()
+        finally: self.workers.pop(key, None)
+
+    def _fail(self, key: tuple, entry: dict, reason: str, force: bool = False):
+        """Abandonne l'édition en cours ; un contenu plus récent reste en attente sauf si le message est inaccessible."""
+        self.failures[reason] += 1
+        print(f"ERREUR: Édition du message {key[1]} abandonnée ({reason}).")
+        if force or self.pending.get(key) is entry: self.pending.pop(key, None); self.schedule_save()
+
+    def schedule_save(self):
+        if self.save_scheduled: return
+        self.save_scheduled = True
+        asyncio.get_running_loop().call_later(EDIT_QUEUE_SAVE_DELAY, self.save)
+
+    def save(self):
+        self.save_scheduled = False
+        views = {cls: name for name, cls in PERSISTENT_PANEL_VIEWS.items()}
+        data = [{"channel_id": channel_id, "message_id": message_id, "embeds": [e.to_dict() for e in entry["embeds"] or []], "view": views.get(type(entry["view"])), "stock_panel": entry["stock_panel"]}
+                for (channel_id, message_id), entry in self.pending.items()]
+        with open(self.path, "w", encoding="utf-8") as f: json.dump(data, f, ensure_ascii=False)
+
+    def restore(self):
+        """Reprend les éditions non envoyées avant le dernier arrêt (une seule fois, au premier on_ready)."""
+        if self.restored: return 0
+        self.restored = True
+        try:
+            with open(self.path, "r", encoding="utf-8") as f: data = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError): return 0
+        restored = 0
+        for item in data:
+            channel = bot.get_channel(item["channel_id"])
+            if channel is None:
+                self.failures["salon introuvable"] += 1
+                if item.get("stock_panel"): unregister_stock_panel(*item["stock_panel"], item["channel_id"], item["message_id"])
+                continue
+            view_cls = PERSISTENT_PANEL_VIEWS.get(item.get("view"))
+            stock_panel = tuple(item["stock_panel"]) if item.get("stock_panel") else None
+            self.submit(channel.get_partial_message(item["message_id"]), embeds=[discord.Embed.from_dict(e) for e in item["embeds"]], view=view_cls() if view_cls else None, stock_panel=stock_panel)
+            restored += 1
+        if restored < len(data): self.save()
+        return restored
+
+    async def join(self):
+        while self.workers: await asyncio.gather(*list(self.workers.values()), return_exceptions=True)
+        self.save()
+
+    def stats(self):
+        return {"pending": len(self.pending), "in_flight": len(self.workers), "sent": self.sent, "retries": self.retries, "merged": self.merged, "failed": sum(self.failures.values())}
+
+# Views sans argument pouvant être recréées après un redémarrage
+PERSISTENT_PANEL_VIEWS = {cls.__name__: cls for cls in (StockView, LocationsView, AnnuaireView, AbsenceView, AnnonceView, OpenChannelInitView, FinancialPanelView, BalancesSummaryView)}
+edit_queue = PanelEditQueue(os.path.join(DATA_DIR, EDIT_QUEUE_FILE))
+PROFILABLE_HANDLERS.update(f"!{command.qualified_name}" for command in bot.walk_commands() if command.name != "profile")
+
+# =================================================================================
+# SECTION 15 : GESTION GÉNÉRALE DU BOT
+# =================================================================================
+slash_commands_synced = False
+
+def find_component_label(message: discord.Message, custom_id: str):
+    for row in message.components if message else []:
+        for component in getattr(row, "children", [row]):
+            if getattr(component, "custom_id", None) == custom_id: return getattr(component, "label", None) or getattr(component, "placeholder", None)
+    return None
+
+@bot.listen("on_interaction")
+async def record_interaction_trace(interaction: discord.Interaction):
+    if not INTERACTION_TRACE_PATH: return
+    data = interaction.data or {}
+    entry = {"ts": time.time(), "guild_id": interaction.guild_id, "user_id": interaction.user.id if interaction.user else None, "kind": interaction.type.name, "custom_id": data.get("custom_id") or data.get("name")}
+    if interaction.type == discord.InteractionType.component: entry["label"] = find_component_label(interaction.message, data.get("custom_id")) # Les custom_id des Views temporaires changent à chaque ouverture
+    elif interaction.type == discord.InteractionType.application_command: entry["options"] = data.get("options", [])
+    try:
+        with open(INTERACTION_TRACE_PATH, "a", encoding="utf-8") as f: f.write(json.dumps(entry) + "\n")
+    except OSError as e: print(f"Erreur enregistrement de la trace d'interactions: {e}")
+
+@bot.check
+async def guild_only(ctx): return ctx.guild is not None
+
 @bot.event
 async def on_ready():
     print(f'Bot connecté sous le nom : {bot.user.name}')
+    if not resolve_legacy_guild(): await bot.close(); return
     bot.add_view(StockView())
+    bot.add_view(LocationsView())
     bot.add_view(AnnuaireView())
     bot.add_view(AbsenceView())
     bot.add_view(AnnonceView())
     bot.add_view(OpenChannelInitView())
     bot.add_view(FinancialPanelView())
     bot.add_view(BalancesSummaryView())
-    weekly_recap_task.start()
+    global slash_commands_synced
+    if not slash_commands_synced:
+        try: await bot.tree.sync(); slash_commands_synced = True
+        except discord.HTTPException as e: print(f"Erreur synchronisation des commandes slash: {e}")
+    if not weekly_recap_task.is_running(): weekly_recap_task.start()
+    if not absence_digest_task.is_running(): absence_digest_task.start()
+    if member_cache.mode == "relevant" and not member_cache_refresh_task.is_running(): member_cache_refresh_task.start()
+    restored = edit_queue.restore()
+    if restored: print(f"{restored} édition(s) de panneau reprise(s) après redémarrage.")
 
 # --- Lancement du bot ---
-if TOKEN:
-    bot.run(TOKEN)
-else:
-    print("ERREUR : Le token Discord n'a pas été trouvé.")
+if __name__ == "__main__":
+    if TOKEN:
+        bot.run(TOKEN)
+    else:
+        print("ERREUR : Le token Discord n'a pas été trouvé.")
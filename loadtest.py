@@ -0,0 +1,607 @@
+"""Générateur de charge pour le bot : simule des employés qui cliquent en même temps sur les panneaux.
+
+Une fausse passerelle envoie des payloads INTERACTION_CREATE synthétiques à bot._connection.parse_interaction_create :
+le routage par custom_id du ViewStore, les Views enregistrées par bot.add_view, interaction_check et la lecture des
+valeurs des Modals sont ceux de discord.py. Les appels REST du bot (HTTPClient.request) et les réponses aux interactions
+(adaptateur webhook) passent par une fausse API Discord dont la latence est configurable. Aucune connexion à Discord
+n'est faite et les données sont écrites dans un dossier temporaire.
+
+Exemples :
+    python loadtest.py --concurrency 40 --iterations 400
+    python loadtest.py --concurrency 40 --duration 30 --mix trip=4,stock_update=2,stock_refresh=1
+    python loadtest.py --record trace.jsonl             (enregistre la trace comme INTERACTION_TRACE_PATH)
+    python loadtest.py --replay trace.jsonl --speed 2   (rejoue chaque interaction de la trace comme une étape)
+    python loadtest.py --member-cache relevant          (vérifie que l'annuaire et les récapitulatifs n'appellent pas fetch_member)
+    python loadtest.py --edit-error-rate 0.2            (20 % des éditions de messages échouent en 503)
+"""
+import argparse
+import asyncio
+import contextvars
+import itertools
+import json
+import os
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from collections import OrderedDict, defaultdict
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+def early_option(name: str, default: str):
+    """Lit une option avant argparse : le bot fixe ses drapeaux de cache des membres à l'import."""
+    for n, arg in enumerate(sys.argv):
+        if arg == f"--{name}" and n + 1 < len(sys.argv): return sys.argv[n + 1]
+        if arg.startswith(f"--{name}="): return arg.split("=", 1)[1]
+    return default
+
+# Le bot lit DATA_DIR et MEMBER_CACHE_MODE à l'import : on isole les données du test avant de l'importer.
+os.environ["DATA_DIR"] = tempfile.mkdtemp(prefix="loadtest-")
+os.environ["MEMBER_CACHE_MODE"] = early_option("member-cache", os.environ.get("MEMBER_CACHE_MODE", "full"))
+os.environ.pop("LEGACY_GUILD_ID", None)
+os.environ.pop("INTERACTION_TRACE_PATH", None)
+import bot  # noqa: E402
+from bot import discord  # noqa: E402
+from discord.ui.view import ViewStore  # noqa: E402
+from discord.webhook.async_ import AsyncWebhookAdapter, async_context  # noqa: E402
+
+current_step = contextvars.ContextVar("current_step", default="hors interaction")
+# Étapes qui ne doivent jamais récupérer un membre par REST (annuaire et panneaux récapitulatifs)
+CACHE_ONLY_STEPS = ("annuaire_refresh", "annuaire_number.modal", "trip.modal")
+ACK_DEADLINE = 3.0 # Discord invalide une interaction non acquittée en 3 secondes
+TRIP_AMOUNT = 3200 # Montant d'un trajet T1
+GUILD_ID, BOT_ID, PATRON_ID = 1, 999, 2
+ROLE_IDS = {name: 11 + n for n, name in enumerate(bot.STAFF_ROLES)}
+CHANNEL_IDS = {"stocks": 101, "stations": 102, "commandes": 109, "annuaire_channel_id": 103, "balances_summary_channel_id": 104, "stock_log_channel_id": 105, "finance_log_channel_id": 106,
+               "absence_channel_id": 107, "report_channel_id": 108, "announcement_channel_id": 110, "management_channel_id": 111}
+LOG_CHANNELS = ("stock_log_channel_id", "finance_log_channel_id", "report_channel_id") # Messages non conservés (mémoire bornée)
+DEFAULT_MIX = "trip=4,stock_update=2,stock_refresh=2,stock_movement=2,locations_update=2,locations_refresh=1,annuaire_number=1,annuaire_refresh=1,finance_history=1,finance_refresh=1,absence=1,absents=1"
+REPLAY_KINDS = ("component", "modal_submit", "application_command")
+EPHEMERAL = 64
+
+def not_found(code: int, message: str): return discord.NotFound(SimpleNamespace(status=404, reason="Not Found"), {"code": code, "message": message})
+
+def iter_components(message: dict):
+    for row in message.get("components") or []:
+        yield from row.get("components", [row])
+
+def find_component(message: dict, custom_id: str = None, label: str = None):
+    """Composant d'un message par custom_id, sinon par libellé (bouton) ou texte d'invite (menu)."""
+    components = list(iter_components(message))
+    return (next((c for c in components if custom_id and c.get("custom_id") == custom_id), None)
+            or next((c for c in components if label and label in (c.get("label"), c.get("placeholder"))), None))
+
+def embed_content(embeds: list):
+    """Champs et description des embeds (sans pied de page horodaté) pour comparer un panneau à son contenu attendu."""
+    return [[(f["name"], f["value"]) for f in embed.get("fields", [])] + [embed.get("description")] for embed in embeds]
+
+# =================================================================================
+# FAUSSE API DISCORD
+# =================================================================================
+class Exchange:
+    """Une interaction envoyée par la fausse passerelle et tout ce que le bot a répondu."""
+    def __init__(self, payload: dict):
+        self.id, self.token, self.channel_id = int(payload["id"]), payload["token"], int(payload["channel_id"])
+        self.message = payload.get("message") # Message portant le composant cliqué
+        self.user = payload["member"]["user"]
+        self.created, self.acked = time.perf_counter(), None
+        self.responses, self.messages, self.modal = [], [], None # Callbacks, messages créés, modal ouvert
+    @property
+    def view_message(self):
+        """Dernier message avec composants reçu en réponse (message éphémère, suivi ou message édité)."""
+        return next((m for m in reversed(self.messages) if m.get("components")), None)
+    @property
+    def texts(self): return [m.get("content") or "" for m in self.messages]
+
+class FakeDiscordAPI:
+    """Remplace les routes REST utilisées par le bot et les webhooks d'interaction ; conserve les messages et les membres en payloads JSON."""
+    def __init__(self, latency_ms: float, jitter_ms: float, edit_error_rate: float = 0.0):
+        self.latency, self.jitter, self.edit_error_rate = latency_ms / 1000, jitter_ms / 1000, edit_error_rate
+        self.calls = defaultdict(int)
+        self.sequence = itertools.count()
+        self.channels = {} # channel_id -> {message_id: payload}, None pour les salons de logs
+        self.ephemeral = OrderedDict() # message_id -> payload des messages éphémères récents
+        self.members = {} # member_id -> payload
+        self.member_fetch_steps = defaultdict(int) # étape -> appels fetch_member
+        self.exchanges = {} # token -> Exchange
+        self.bot_user = {"id": str(BOT_ID), "username": "TotalEnergiesBot", "global_name": None, "discriminator": "0", "avatar": None, "bot": True}
+
+    def snowflake(self):
+        """Identifiant horodaté comme ceux de Discord (Interaction.is_expired se base sur la date encodée)."""
+        return discord.utils.time_snowflake(datetime.now(timezone.utc)) + next(self.sequence) % (1 << 22)
+
+    async def network_delay(self): await asyncio.sleep(max(0.0, random.gauss(self.latency, self.jitter)))
+
+    def add_member(self, member_id: int, name: str, roles: list, is_bot: bool = False):
+        user = dict(self.bot_user) if is_bot else {"id": str(member_id), "username": name, "global_name": name, "discriminator": "0", "avatar": None, "bot": False}
+        self.members[member_id] = {"user": user, "roles": [str(ROLE_IDS[r]) for r in roles], "nick": None, "avatar": None, "joined_at": "2024-01-01T00:00:00+00:00",
+                                   "deaf": False, "mute": False, "flags": 0, "pending": False}
+
+    def guild_payload(self, name: str = "Charge"):
+        roles = [{"id": str(GUILD_ID), "name": "@everyone", "permissions": "0", "position": 0, "color": 0, "hoist": False, "managed": False, "mentionable": False}]
+        roles += [{"id": str(role_id), "name": name, "permissions": "0", "position": len(ROLE_IDS) - n, "color": 0, "hoist": False, "managed": False, "mentionable": False}
+                  for n, (name, role_id) in enumerate(ROLE_IDS.items())]
+        channels = [{"id": str(channel_id), "type": 0, "name": f"salon-{channel_id}", "position": n, "guild_id": str(GUILD_ID), "permission_overwrites": [], "nsfw": False,
+                     "parent_id": None, "topic": None, "last_message_id": None, "rate_limit_per_user": 0} for n, channel_id in enumerate(self.channels)]
+        return {"id": str(GUILD_ID), "name": name, "owner_id": str(PATRON_ID), "roles": roles, "channels": channels, "members": list(self.members.values()),
+                "member_count": len(self.members), "features": [], "emojis": [], "stickers": [], "large": False}
+
+    def new_message(self, channel_id: int, data: dict, author: dict = None, **extra):
+        payload = {"id": str(self.snowflake()), "channel_id": str(channel_id), "guild_id": str(GUILD_ID), "author": author or self.bot_user,
+                   "content": data.get("content") or "", "embeds": data.get("embeds") or [], "components": data.get("components") or [], "flags": data.get("flags") or 0,
+                   "attachments": [], "mentions": [], "mention_roles": [], "mention_everyone": False, "pinned": False, "tts": False, "type": 0,
+                   "timestamp": datetime.now(timezone.utc).isoformat(), "edited_timestamp": None, **extra}
+        if payload["flags"] & EPHEMERAL:
+            self.ephemeral[int(payload["id"])] = payload
+            while len(self.ephemeral) > 10_000: self.ephemeral.popitem(last=False)
+        elif self.channels.get(channel_id) is not None: self.channels[channel_id][int(payload["id"])] = payload
+        return payload
+
+    def get_message(self, channel_id: int, message_id: int):
+        message = (self.channels.get(channel_id) or {}).get(message_id) or self.ephemeral.get(message_id)
+        if message is None: raise not_found(10008, "Unknown Message")
+        return message
+
+    @staticmethod
+    def update_message(message: dict, data: dict):
+        """Édition en place : les scénarios gardent une référence sur le payload des panneaux."""
+        for key in ("content", "embeds", "components"):
+            if key in data: message[key] = data[key] or ("" if key == "content" else [])
+        message["edited_timestamp"] = datetime.now(timezone.utc).isoformat()
+        return message
+
+    async def request(self, route, *, files=None, form=None, json=None, params=None, **kwargs):
+        """Remplace bot.http.request : toutes les routes REST du bot passent par ici."""
+        key = f"{route.method} {route.path}"
+        self.calls[key] += 1
+        values = dict(zip(route.path.split("/"), route.url[len(route.BASE):].split("/")))
+        channel_id, params = int(route.channel_id or 0), params or {}
+        await self.network_delay()
+        if route.path == "/channels/{channel_id}/messages":
+            if route.method == "POST": return self.new_message(channel_id, json or {})
+            messages = list(reversed((self.channels.get(channel_id) or {}).values()))
+            if params.get("before"): messages = [m for m in messages if int(m["id"]) < int(params["before"])]
+            return messages[:int(params.get("limit", 50))]
+        if route.path == "/channels/{channel_id}/messages/{message_id}":
+            message_id = int(values["{message_id}"])
+            if route.method == "DELETE": (self.channels.get(channel_id) or {}).pop(message_id, None); return None
+            message = self.get_message(channel_id, message_id)
+            if route.method == "GET": return message
+            if random.random() < self.edit_error_rate:
+                self.calls[f"{key} (503)"] += 1
+                raise discord.DiscordServerError(SimpleNamespace(status=503, reason="Service Unavailable"), "upstream connect error")
+            return self.update_message(message, json or {})
+        if route.path == "/guilds/{guild_id}/members":
+            members = sorted(self.members.items())
+            after = int(params.get("after", 0))
+            return [payload for member_id, payload in members if member_id > after][:int(params.get("limit", 1000))]
+        if route.path.startswith("/guilds/{guild_id}/members/{"):
+            member = self.members.get(int(route.url.rsplit("/", 1)[1]))
+            if member is None: raise not_found(10007, "Unknown Member")
+            if route.method == "GET": self.member_fetch_steps[current_step.get()] += 1
+            return member
+        raise discord.HTTPException(SimpleNamespace(status=501, reason="Not Implemented"), f"Route non simulée : {key}")
+
+    async def interaction_request(self, route, payload: dict):
+        """Callbacks et webhooks d'interaction (réponse initiale, suivis, édition de la réponse d'origine)."""
+        key = f"{route.method} {route.path}"
+        self.calls[key] += 1
+        await self.network_delay()
+        exchange = self.exchanges.get(route.webhook_token)
+        if exchange is None: raise not_found(10015, "Unknown Webhook")
+        if route.path.endswith("/callback"):
+            if time.perf_counter() - exchange.created > ACK_DEADLINE: raise not_found(10062, "Unknown interaction")
+            if exchange.acked is not None: raise discord.HTTPException(SimpleNamespace(status=400, reason="Bad Request"), {"code": 40060, "message": "Interaction has already been acknowledged."})
+            exchange.acked = time.perf_counter(); exchange.responses.append(payload)
+            kind, data = payload["type"], payload.get("data") or {}
+            if kind == 4: exchange.messages.append(self.new_message(exchange.channel_id, data, interaction={"id": str(exchange.id), "type": 3, "name": "", "user": exchange.user}))
+            elif kind == 7 and exchange.message: exchange.messages.append(self.update_message(self.get_message(exchange.channel_id, int(exchange.message["id"])), data))
+            elif kind == 9: exchange.modal = data
+            return None
+        if route.path == "/webhooks/{webhook_id}/{webhook_token}":
+            message = self.new_message(exchange.channel_id, payload or {}, webhook_id=str(BOT_ID))
+            exchange.messages.append(message)
+            return message
+        if route.path.endswith("/messages/@original"):
+            original = next((m for m in exchange.messages if m.get("interaction")), None)
+            if original is None and exchange.message: original = self.get_message(exchange.channel_id, int(exchange.message["id"])) # Réponse différée d'un composant
+            if original is None: raise not_found(10008, "Unknown Message")
+            return self.update_message(original, payload or {}) if route.method == "PATCH" else original
+        raise discord.HTTPException(SimpleNamespace(status=501, reason="Not Implemented"), f"Route non simulée : {key}")
+
+class FakeWebhookAdapter(AsyncWebhookAdapter):
+    def __init__(self, api: FakeDiscordAPI): super().__init__(); self.api = api
+    async def request(self, route, session, *, payload=None, multipart=None, **kwargs):
+        if payload is None and multipart: payload = json.loads(multipart[0]["value"])
+        return await self.api.interaction_request(route, payload)
+
+# =================================================================================
+# FAUSSE PASSERELLE, MONDE SIMULÉ ET SCÉNARIOS
+# =================================================================================
+class LoadTest:
+    def __init__(self, args):
+        self.args = args
+        self.api = FakeDiscordAPI(args.http_latency_ms, args.http_jitter_ms)
+        self.state, self.guild = bot.bot._connection, None
+        self.latencies = defaultdict(list) # étape -> latences d'acquittement (s)
+        self.scenario_durations = defaultdict(list)
+        self.errors, self.late_acks, self.unacked, self.skipped = defaultdict(int), 0, 0, 0
+        self.trips = defaultdict(int) # membre -> trajets validés
+        self.numbers, self.absences = {}, 0
+        self.panels, self.financial_panels = {}, {} # custom_id persistant -> panneau ; membre -> panneau financier
+        self.finance_channels = {} # salon privé -> membre
+        self.replay_users = {} # utilisateur de la trace -> employé simulé
+        self.loop_lag = []
+
+    @property
+    def employees(self): return [member_id for member_id in self.api.members if member_id >= 1000]
+
+    async def gateway(self, parser: str, payload: dict):
+        """Envoie un événement de passerelle au parseur de discord.py et attend les tâches qu'il a lancées (Views, Modals, commandes, listeners)."""
+        before = asyncio.all_tasks()
+        self.state.parsers[parser](payload)
+        await asyncio.gather(*(asyncio.all_tasks() - before), return_exceptions=True)
+
+    async def send_command(self, user: int, channel_id: int, content: str):
+        member = {k: v for k, v in self.api.members[user].items() if k != "user"}
+        await self.gateway("MESSAGE_CREATE", self.api.new_message(channel_id, {"content": content}, author=self.api.members[user]["user"], member=member))
+
+    async def interact(self, step: str, user: int, kind: int, data: dict, channel_id: int, message: dict = None):
+        """Envoie un INTERACTION_CREATE et mesure le délai d'acquittement."""
+        interaction_id = self.api.snowflake()
+        payload = {"id": str(interaction_id), "application_id": str(BOT_ID), "type": kind, "token": f"token-{interaction_id}", "version": 1, "guild_id": str(GUILD_ID),
+                   "channel_id": str(channel_id), "channel": {"id": str(channel_id), "type": 0}, "member": {**self.api.members[user], "permissions": "0"},
+                   "locale": "fr", "guild_locale": "fr", "app_permissions": "0", "data": data}
+        if message is not None: payload["message"] = message
+        exchange = self.api.exchanges[payload["token"]] = Exchange(payload)
+        current_step.set(step)
+        try: await self.gateway("INTERACTION_CREATE", payload)
+        finally: self.api.exchanges.pop(payload["token"], None)
+        if exchange.acked is None: self.unacked += 1; return exchange
+        latency = exchange.acked - exchange.created
+        self.latencies[step].append(latency)
+        if latency > ACK_DEADLINE: self.late_acks += 1
+        return exchange
+
+    async def click(self, step: str, user: int, message: dict, custom_id: str = None, label: str = None, value: str = None):
+        component = find_component(message, custom_id, label) if message else None
+        if component is None: self.errors[f"{step}: composant introuvable"] += 1; return None
+        data = {"custom_id": component["custom_id"], "component_type": component["type"]}
+        if component["type"] == 3: data["values"] = [value or random.choice(component["options"])["value"]]
+        return await self.interact(step, user, 3, data, int(message["channel_id"]), message)
+
+    async def submit(self, step: str, user: int, opened: Exchange, values: dict = None):
+        """Soumet le modal ouvert par `opened` avec les valeurs données, ou générées selon sa classe."""
+        if opened is None or opened.modal is None: self.errors[f"{step}: modal non ouvert"] += 1; return None, {}
+        modal = self.state._view_store._modals.get(opened.modal["custom_id"])
+        fields = [c["custom_id"] for row in opened.modal["components"] for c in row["components"]]
+        values = values or (self.modal_values(modal) if modal else {})
+        data = {"custom_id": opened.modal["custom_id"], "components": [{"type": 1, "components": [{"type": 4, "custom_id": field, "value": values.get(field, "")}]} for field in fields]}
+        return await self.interact(step, user, 5, data, opened.channel_id), values
+
+    async def command(self, step: str, user: int, name: str, options: list = None):
+        command = self.state._command_tree.get_command(name)
+        if command is None: self.errors[f"{step}: commande inconnue"] += 1; return None
+        data = {"id": str(self.api.snowflake()), "name": name, "type": 1, "options": options or []}
+        resolved = [o["value"] for o in data["options"] if o.get("type") == 6 and int(o["value"]) in self.api.members]
+        if resolved: data["resolved"] = {"users": {i: self.api.members[int(i)]["user"] for i in resolved}, "members": {i: {k: v for k, v in self.api.members[int(i)].items() if k != "user"} for i in resolved}}
+        return await self.interact(step, user, 2, data, CHANNEL_IDS["commandes"])
+
+    def modal_values(self, modal):
+        name = type(modal).__name__
+        if name == "StockMovementModal":
+            location, pumps = random.choice([(loc, data["pumps"]) for loc, data in bot.load_locations(GUILD_ID)["stations"].items()])
+            values = (random.choice(["livraison", "transfert", "raffinage", "remplissage", "remplissage"]), random.choice(["gazole", "sp95", "sp98"]), str(random.randint(1, 500)), f"{location} / {random.choice(list(pumps))}")
+            return {item.custom_id: value for item, value in zip((modal.type_mouvement, modal.carburant, modal.quantite, modal.destination), values)}
+        if name == "DeclareTripModal": return {modal.trip_type.custom_id: "T1", modal.location.custom_id: ""}
+        if name == "AbsenceModal": return {modal.date_debut.custom_id: "aujourd'hui", modal.date_fin.custom_id: "demain", modal.motif.custom_id: "Test de charge"}
+        if name == "AnnuaireModal": return {modal.children[0].custom_id: f"06{random.randint(0, 99_999_999):08d}"}
+        if name in ("TotalStockModal", "StockModal", "LocationUpdateModal"): return {item.custom_id: str(random.randint(0, 3000 if name == "LocationUpdateModal" else 50_000)) for item in modal.children}
+        return {item.custom_id: item.default or "Test de charge" for item in modal.children}
+
+    async def start_bot(self):
+        """Met le client dans l'état d'après READY / GUILD_CREATE, sans passerelle ni session HTTP réelles."""
+        for member_id, name, roles in [(PATRON_ID, "Patron", ["Patron"])] + [(1000 + n, f"Employé {n:03d}", ["Employé"]) for n in range(self.args.users)]:
+            self.api.add_member(member_id, name, roles)
+        self.api.add_member(BOT_ID, "TotalEnergiesBot", [], is_bot=True)
+        for key, channel_id in CHANNEL_IDS.items(): self.api.channels[channel_id] = None if key in LOG_CHANNELS else {}
+        for member_id in self.employees:
+            channel_id = self.api.snowflake(); self.finance_channels[channel_id] = member_id; self.api.channels[channel_id] = {}
+        await bot.bot._async_setup_hook()
+        bot.bot.http.request = self.api.request
+        async_context.set(FakeWebhookAdapter(self.api))
+        self.state.user = discord.ClientUser(state=self.state, data=self.api.bot_user)
+        self.state.application_id = BOT_ID
+        self.guild = self.state._add_guild_from_data(self.api.guild_payload())
+        bot.slash_commands_synced = True # Pas de synchronisation des commandes slash
+        self.install_error_hooks()
+        await bot.on_ready()
+        bot.bot._ready.set()
+
+    def record_error(self, error: BaseException): self.errors[f"{current_step.get()}: {type(error).__name__}"] += 1
+
+    def install_error_hooks(self):
+        """Les erreurs des handlers sont comptées par étape au lieu d'être seulement journalisées."""
+        record = self.record_error
+        async def view_error(view, interaction, error, item): record(error)
+        async def modal_error(modal, interaction, error): record(error)
+        async def tree_error(interaction, error): record(getattr(error, "original", error))
+        async def command_error(ctx, error): record(getattr(error, "original", error))
+        async def event_error(event, *args, **kwargs): record(sys.exc_info()[1])
+        discord.ui.View.on_error, discord.ui.Modal.on_error = view_error, modal_error
+        bot.bot.tree.on_error, bot.bot.on_error = tree_error, event_error
+        bot.bot.add_listener(command_error, "on_command_error")
+
+    async def setup_world(self):
+        """Installe les panneaux avec les vraies commandes, puis simule un redémarrage : seules les Views de bot.add_view restent routées."""
+        current_step.set("mise en place")
+        for key, channel_id in CHANNEL_IDS.items():
+            if key in bot.GUILD_CONFIG_FIELDS: await self.send_command(PATRON_ID, CHANNEL_IDS["commandes"], f"!setup config {bot.GUILD_CONFIG_FIELDS[key][0]} <#{channel_id}>")
+        await self.check_setup_access()
+        await self.send_command(PATRON_ID, CHANNEL_IDS["stocks"], "!stocks")
+        await self.send_command(PATRON_ID, CHANNEL_IDS["stations"], "!stations")
+        await self.send_command(PATRON_ID, CHANNEL_IDS["commandes"], "!setup")
+        for member_id in self.employees:
+            member = discord.Member(data=self.api.members[member_id], guild=self.guild, state=self.state)
+            channel_id = next(c for c, m in self.finance_channels.items() if m == member_id)
+            await self.guild.get_channel(channel_id).send(embed=bot.create_financial_embed(member), view=bot.FinancialPanelView())
+        self.state._view_store = ViewStore(self.state)
+        await bot.on_ready()
+        if bot.member_cache.mode == "relevant": await bot.warm_member_cache(self.guild)
+        for channel_id, messages in self.api.channels.items():
+            for message in (messages or {}).values():
+                for component in iter_components(message):
+                    if channel_id in self.finance_channels: self.financial_panels[self.finance_channels[channel_id]] = message
+                    else: self.panels.setdefault(component.get("custom_id"), message)
+        missing = [custom_id for custom_id in ("update_stock", "update_location", "update_annuaire_number", "declare_absence") if custom_id not in self.panels]
+        if missing or len(self.financial_panels) != len(self.employees): raise SystemExit(f"Mise en place incomplète : panneaux manquants {missing}, erreurs {dict(self.errors)}")
+
+    async def check_setup_access(self):
+        """Un employé sans rôle Patron / Co-Patron doit recevoir MissingAnyRole sur !setup et ses sous-commandes, sans rien modifier."""
+        current_step.set("contrôle d'accès")
+        config, attempts = dict(bot.get_guild_config(GUILD_ID)), ("!setup", "!setup config radio PIRATE", "!setup config logs_stock aucun")
+        for content in attempts: await self.send_command(self.employees[0], CHANNEL_IDS["commandes"], content)
+        denied = self.errors.pop("contrôle d'accès: MissingAnyRole", 0)
+        if denied != len(attempts) or bot.get_guild_config(GUILD_ID) != config: raise SystemExit(f"!setup accessible sans rôle Patron / Co-Patron : {denied} refus sur {len(attempts)}, erreurs {dict(self.errors)}")
+        current_step.set("mise en place")
+
+    async def scenario_stock_update(self, user):
+        first = await self.click("stock_update.button", user, self.panels["update_stock"], "update_stock")
+        if not first or not first.view_message: return
+        second = await self.click("stock_update.category", user, first.view_message, label="📊 Total")
+        if second and second.modal: await self.submit("stock_update.modal", user, second)
+
+    async def scenario_stock_movement(self, user):
+        custom_id = random.choice(["stock_movement", "locations_stock_movement"])
+        first = await self.click("stock_movement.button", user, self.panels[custom_id], custom_id)
+        if first and first.modal: await self.submit("stock_movement.modal", user, first)
+
+    async def scenario_stock_refresh(self, user):
+        await self.click("stock_refresh", user, self.panels["refresh_stock"], "refresh_stock")
+
+    async def scenario_locations_update(self, user):
+        first = await self.click("locations_update.button", user, self.panels["update_location"], "update_location")
+        if not first or not first.view_message: return
+        ephemeral = first.view_message
+        second = await self.click("locations_update.category", user, ephemeral, label="Stations")
+        if not second: return
+        third = await self.click("locations_update.location", user, ephemeral, custom_id="locations_loc_selector")
+        if third and not third.modal: third = await self.click("locations_update.pump", user, ephemeral, custom_id="locations_pump_selector")
+        if third and third.modal: await self.submit("locations_update.modal", user, third)
+
+    async def scenario_locations_refresh(self, user):
+        await self.click("locations_refresh", user, self.panels["refresh_locations"], "refresh_locations")
+
+    async def scenario_annuaire_number(self, user):
+        first = await self.click("annuaire_number.button", user, self.panels["update_annuaire_number"], "update_annuaire_number")
+        if not first or not first.modal: return
+        done, values = await self.submit("annuaire_number.modal", user, first)
+        if done and done.acked and values: self.numbers[user] = next(iter(values.values()))
+
+    async def scenario_annuaire_refresh(self, user):
+        await self.click("annuaire_refresh", user, self.panels["refresh_annuaire"], "refresh_annuaire")
+
+    async def scenario_trip(self, user):
+        first = await self.click("trip.button", user, self.financial_panels[user], "declare_trip")
+        if not first or not first.modal: return
+        done, _ = await self.submit("trip.modal", user, first)
+        if done and any(text.startswith("✅") for text in done.texts): self.trips[user] += 1
+
+    async def scenario_finance_history(self, user):
+        await self.click("finance_history", user, self.financial_panels[user], "financial_history")
+
+    async def scenario_finance_refresh(self, user):
+        await self.click("finance_refresh", user, self.financial_panels[user], "refresh_financial_panel")
+
+    async def scenario_absence(self, user):
+        first = await self.click("absence.button", user, self.panels["declare_absence"], "declare_absence")
+        if not first or not first.modal: return
+        done, _ = await self.submit("absence.modal", user, first)
+        if done and done.acked and any("✅" in text for text in done.texts): self.absences += 1
+
+    async def scenario_absents(self, user):
+        await self.command("absents", user, "absents")
+
+    async def run_scenario(self, name: str, user):
+        start = time.perf_counter()
+        await getattr(self, f"scenario_{name}")(user)
+        self.scenario_durations[name].append(time.perf_counter() - start)
+
+    async def monitor_loop_lag(self, interval: float = 0.01):
+        while True:
+            start = time.perf_counter()
+            await asyncio.sleep(interval)
+            self.loop_lag.append(max(0.0, time.perf_counter() - start - interval))
+
+    async def run_closed_loop(self, mix: dict):
+        names, weights = list(mix), list(mix.values())
+        employees = self.employees
+        remaining = itertools.count()
+        deadline = time.perf_counter() + self.args.duration if self.args.duration else None
+        async def worker(worker_id: int):
+            user = employees[worker_id % len(employees)]
+            while True:
+                if deadline is not None and time.perf_counter() >= deadline: return
+                if deadline is None and next(remaining) >= self.args.iterations: return
+                await self.run_scenario(random.choices(names, weights)[0], user)
+                if self.args.think_ms: await asyncio.sleep(random.expovariate(1000 / self.args.think_ms))
+        await asyncio.gather(*(worker(n) for n in range(self.args.concurrency)))
+
+    async def replay_event(self, event: dict, user: int, session: dict):
+        """Rejoue une interaction de la trace comme une étape : clic sur un panneau ou sur la dernière réponse éphémère de l'employé,
+        soumission du modal qu'il a ouvert, ou commande slash (lancée par le patron)."""
+        kind, custom_id, label = event["kind"], event.get("custom_id"), event.get("label")
+        start = time.perf_counter()
+        if kind == "component":
+            panel = self.financial_panels[user] if find_component(self.financial_panels[user], custom_id) else self.panels.get(custom_id)
+            message = panel or next((m for m in reversed(session["messages"]) if find_component(m, custom_id, label)), None)
+            if message is None: self.skipped += 1; return
+            exchange = await self.click(f"{kind}:{custom_id if panel else label or custom_id}", user, message, custom_id, label)
+        elif kind == "modal_submit":
+            opened = session.pop("modal", None)
+            if opened is None: self.skipped += 1; return
+            modal = self.state._view_store._modals.get(opened.modal["custom_id"])
+            exchange, _ = await self.submit(f"{kind}:{type(modal).__name__ if modal else custom_id}", user, opened)
+        else:
+            options = [dict(o, value=str(self.replay_users.setdefault(o["value"], random.choice(self.employees)))) if o.get("type") == 6 else o for o in event.get("options") or []]
+            exchange = await self.command(f"{kind}:{custom_id}", PATRON_ID, custom_id, options)
+        self.scenario_durations[f"rejeu {kind}"].append(time.perf_counter() - start)
+        if exchange is None: return
+        if exchange.modal: session["modal"] = exchange
+        if exchange.view_message: session["messages"] = (session["messages"] + [exchange.view_message])[-5:]
+
+    async def run_replay(self, path: str):
+        with open(path, "r", encoding="utf-8") as f: events = [json.loads(line) for line in f if line.strip()]
+        events = [e for e in events if e.get("kind") in REPLAY_KINDS and e.get("custom_id")]
+        if not events: print("Aucune interaction rejouable dans la trace."); return
+        events.sort(key=lambda e: e["ts"])
+        sessions = defaultdict(lambda: {"messages": [], "modal": None, "lock": asyncio.Lock()}) # Les interactions d'un même employé restent dans l'ordre
+        async def replay(event, user):
+            session = sessions[user]
+            async with session["lock"]: await self.replay_event(event, user, session)
+        employees, start, origin, tasks = self.employees, time.perf_counter(), events[0]["ts"], []
+        for event in events:
+            delay = (event["ts"] - origin) / self.args.speed - (time.perf_counter() - start)
+            if delay > 0: await asyncio.sleep(delay)
+            user = self.replay_users.setdefault(str(event.get("user_id")), employees[len(self.replay_users) % len(employees)])
+            tasks.append(asyncio.create_task(replay(event, user)))
+        await asyncio.gather(*tasks)
+
+    def check_lost_updates(self):
+        finances = bot.load_finances(GUILD_ID)
+        lost_trips = sum(count - finances.get(str(member_id), {}).get("solde", 0) // TRIP_AMOUNT for member_id, count in self.trips.items())
+        annuaire = {entry["id"]: entry.get("number") for group in bot.load_annuaire(GUILD_ID).values() for entry in group}
+        lost_numbers = sum(1 for member_id, number in self.numbers.items() if annuaire.get(member_id) != number)
+        lost_absences = max(0, self.absences - len(bot.load_absences(GUILD_ID))) # Le rejeu déclare des absences sans les compter
+        _, discrepancies = bot.reconcile_stocks(GUILD_ID)
+        return {"trajets": lost_trips, "numéros annuaire": lost_numbers, "absences": lost_absences, "écarts registre des stocks": len(discrepancies), "panneaux obsolètes": self.count_stale_panels(),
+                "fetch_member hors cache": sum(count for step, count in self.api.member_fetch_steps.items() if step in CACHE_ONLY_STEPS)}
+
+    def count_stale_panels(self):
+        """Après vidage de la file d'édition, chaque panneau doit afficher le contenu le plus récent."""
+        expected = [(self.panels["update_stock"], [bot.create_stocks_embed(GUILD_ID)]), (self.panels["update_location"], bot.create_locations_embeds(GUILD_ID))]
+        expected += [(panel, [bot.create_financial_embed(discord.Member(data=self.api.members[member_id], guild=self.guild, state=self.state))]) for member_id, panel in self.financial_panels.items()]
+        return sum(1 for panel, embeds in expected if embed_content(panel["embeds"]) != embed_content([embed.to_dict() for embed in embeds]))
+
+    async def run(self):
+        await self.start_bot()
+        await self.setup_world()
+        self.api.edit_error_rate = self.args.edit_error_rate # Les 503 visent la charge, pas la mise en place
+        if self.args.record: bot.INTERACTION_TRACE_PATH = self.args.record
+        monitor = asyncio.create_task(self.monitor_loop_lag())
+        start = time.perf_counter()
+        if self.args.replay: await self.run_replay(self.args.replay)
+        else: await self.run_closed_loop(parse_mix(self.args.mix))
+        await bot.edit_queue.join()
+        elapsed = time.perf_counter() - start
+        monitor.cancel()
+        for loop in (bot.weekly_recap_task, bot.absence_digest_task, bot.member_cache_refresh_task): loop.cancel()
+        return self.report(elapsed)
+
+    def report(self, elapsed: float):
+        all_latencies = [v for values in self.latencies.values() for v in values]
+        interactions = len(all_latencies)
+        report = {
+            "durée_s": round(elapsed, 3),
+            "interactions": interactions,
+            "scénarios": sum(len(v) for v in self.scenario_durations.values()),
+            "débit_interactions_s": round(interactions / elapsed, 1) if elapsed else 0,
+            "acquittement_ms": percentiles(all_latencies),
+            "par_étape_ms": {step: percentiles(values) for step, values in sorted(self.latencies.items())},
+            "lag_boucle_ms": percentiles(self.loop_lag),
+            "acquittements_hors_délai": self.late_acks,
+            "non_acquittées": self.unacked,
+            "rejeu_ignorées": self.skipped,
+            "erreurs": dict(self.errors),
+            "mises_à_jour_perdues": self.check_lost_updates(),
+            "file_édition": bot.edit_queue.stats(),
+            "appels_http": dict(self.api.calls),
+        }
+        return report
+
+def percentiles(values: list):
+    if not values: return {"n": 0}
+    ordered = sorted(values)
+    pick = lambda q: ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1000
+    return {"n": len(values), "p50": round(pick(0.50), 2), "p95": round(pick(0.95), 2), "p99": round(pick(0.99), 2), "max": round(ordered[-1] * 1000, 2), "moyenne": round(statistics.fmean(values) * 1000, 2)}
+
+def parse_mix(text: str):
+    mix = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if not hasattr(LoadTest, f"scenario_{name}"): raise SystemExit(f"Scénario inconnu : {name}")
+        mix[name] = float(weight or 1)
+    return mix
+
+def print_report(report: dict):
+    ack = report["acquittement_ms"]
+    print(f"\n=== Test de charge : {report['interactions']} interactions / {report['scénarios']} scénarios en {report['durée_s']} s ===")
+    print(f"Débit : {report['débit_interactions_s']} interactions/s")
+    if ack["n"]: print(f"Acquittement (ms) : p50 {ack['p50']} | p95 {ack['p95']} | p99 {ack['p99']} | max {ack['max']}")
+    lag = report["lag_boucle_ms"]
+    if lag["n"]: print(f"Lag de la boucle (ms) : p50 {lag['p50']} | p99 {lag['p99']} | max {lag['max']}")
+    print(f"Hors délai (> {ACK_DEADLINE:.0f} s) : {report['acquittements_hors_délai']} | Non acquittées : {report['non_acquittées']}" + (f" | Rejeu ignorées : {report['rejeu_ignorées']}" if report["rejeu_ignorées"] else ""))
+    print(f"Mises à jour perdues : {report['mises_à_jour_perdues']}")
+    queue = report["file_édition"]
+    print(f"File d'édition : {queue['sent']} envoyées | {queue['merged']} fusionnées | {queue['retries']} nouvelles tentatives | {queue['failed']} échecs")
+    if report["erreurs"]: print(f"Erreurs : {report['erreurs']}")
+    print(f"\n{'Étape':<40}{'n':>6}{'p50':>10}{'p95':>10}{'p99':>10}")
+    for step, stats in report["par_étape_ms"].items():
+        print(f"{step:<40}{stats['n']:>6}{stats['p50']:>10}{stats['p95']:>10}{stats['p99']:>10}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Test de charge du bot TotalEnergies (passerelle et HTTP simulés).")
+    parser.add_argument("--concurrency", type=int, default=40, help="Nombre d'employés simulés en parallèle")
+    parser.add_argument("--users", type=int, default=None, help="Nombre de membres du serveur simulé (par défaut : --concurrency)")
+    parser.add_argument("--iterations", type=int, default=400, help="Nombre total de scénarios (ignoré avec --duration)")
+    parser.add_argument("--duration", type=float, default=None, help="Durée du test en secondes")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="Poids des scénarios, ex: trip=4,stock_update=2")
+    parser.add_argument("--think-ms", type=float, default=0, help="Temps de réflexion moyen entre deux scénarios")
+    parser.add_argument("--http-latency-ms", type=float, default=80, help="Latence moyenne simulée des appels à Discord")
+    parser.add_argument("--http-jitter-ms", type=float, default=30, help="Écart-type de la latence simulée")
+    parser.add_argument("--member-cache", choices=["full", "relevant"], default=bot.MEMBER_CACHE_MODE, help="Mode du cache des membres (MEMBER_CACHE_MODE)")
+    parser.add_argument("--edit-error-rate", type=float, default=0.0, help="Proportion d'éditions de messages qui échouent en 503")
+    parser.add_argument("--record", default=None, help="Enregistre les interactions du test dans cette trace JSONL")
+    parser.add_argument("--replay", default=None, help="Trace JSONL enregistrée avec INTERACTION_TRACE_PATH")
+    parser.add_argument("--speed", type=float, default=1.0, help="Facteur d'accélération du rejeu")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--json", default=None, help="Écrit aussi le rapport complet dans ce fichier")
+    parser.add_argument("--keep-data", action="store_true", help="Conserve le dossier de données du test pour inspection")
+    args = parser.parse_args(argv)
+    args.users = max(args.users or args.concurrency, 1)
+    if args.seed is not None: random.seed(args.seed)
+    bot.EDIT_BACKOFF_BASE, bot.EDIT_BACKOFF_MAX = 0.01, 0.2 # Attentes raccourcies : seul le comportement de la file est mesuré
+    try: report = asyncio.run(LoadTest(args).run())
+    finally:
+        if args.keep_data: print(f"Données du test : {bot.DATA_DIR}")
+        else: shutil.rmtree(bot.DATA_DIR, ignore_errors=True)
+    print_report(report)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f: json.dump(report, f, indent=4, ensure_ascii=False)
+    return 0 if not report["erreurs"] and not report["non_acquittées"] and not any(report["mises_à_jour_perdues"].values()) else 1
+
+if __name__ == "__main__":
+    sys.exit(main())